@@ -1,26 +1,33 @@
 import os
 from flask import (
-    Flask, request, abort, jsonify,
-    flash, current_app, redirect, url_for
+    Flask, request, abort,
+    flash, current_app, redirect, url_for,
+    Response, stream_with_context
 )
+from serialization import jsonify
 
 from models import setup_db
 from flask_cors import CORS
 from flask_cors import cross_origin
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
 import json
 
 # Authentication
-from auth.auth import AuthError, requires_auth
+from auth.auth import AuthError, requires_auth, token_cache
 
 # Import all models
 from models import *
 
 # Supporting functions
 from lib import *
+from db_pool import pool_stats, get_setting, parse_flag
 
 
 def create_app(test_config=None):
     app = Flask(__name__)
+    if test_config is not None:
+        app.config.update(test_config)
     setup_db(app)
     CORS(app)
     '''
@@ -30,7 +37,7 @@ def create_app(test_config=None):
     def after_request(response):
         response.headers.add(
             'Access-Control-Allow-Headers',
-            'Content-Type, Authorization')
+            'Content-Type, Authorization, Prefer')
         response.headers.add(
             'Access-Control-Allow-Methods',
             'GET, POST, PATCH, DELETE, OPTIONS')
@@ -64,11 +71,21 @@ def create_app(test_config=None):
     for all people.
     -----------------------------------------------------------
     ***********************************************************
-    Expected Inputs: None
+    Expected Inputs:
+        limit: int, optional query parameter. Page size.
+        after: string, optional query parameter. nextCursor of
+               the previous page.
+        stream: 'true', optional query parameter. Streams the
+                full listing instead of building it in memory.
+        If-None-Match / If-Modified-Since headers: optional.
+                Validators of a previous response.
     Expected Output:
+         304 Not Modified when the task table did not change.
          list of all tasks from database when successful.
          total number of tasks
          Error otherwise.
+         When limit or after is given, one page of tasks
+         ordered by id and the nextCursor (null on the last page).
     ***********************************************************
     -----------------------------------------------------------
     Required Permissions: list_all_tasks
@@ -80,15 +97,40 @@ def create_app(test_config=None):
     @app.route('/tasks', methods=['GET'])
     @requires_auth('list_all_tasks')
     def tasks(payload):
-        try:
+        if wants_stream():
+            etag, last_modified = get_collection_etag('task')
+            response = not_modified(etag, last_modified)
+            if response is not None:
+                return response
+            response = Response(stream_with_context(stream_tasks()),
+                                mimetype='application/json')
+            return set_validators(response, etag, last_modified)
+
+        def validators():
+            return get_collection_etag('task')
+
+        page = get_page_args()
+        if page is not None:
+            def build_page():
+                tasks, next_cursor = get_tasks_page(*page)
+                return {'success': True,
+                        'tasks': tasks,
+                        'nextCursor': next_cursor}
+            return cached_json_response('tasks', ('task',),
+                                        validators, build_page)
+
+        def build():
             tasks = get_tasks()
+            return {'success': True,
+                    'tasks': tasks,
+                    'totalTasks': len(tasks)}
+        try:
+            return cached_json_response('tasks', ('task',),
+                                        validators, build)
         except Exception as e:
             print(e)
             return jsonify({'success': False,
                             'message': e})
-        return jsonify({'success': True,
-                        'tasks': tasks,
-                        'totalTasks': len(tasks)})
 
     '''
     -----------------------------------------------------------
@@ -96,11 +138,21 @@ def create_app(test_config=None):
     people
     -----------------------------------------------------------
     ***********************************************************
-    Expected Inputs: None
+    Expected Inputs:
+        limit: int, optional query parameter. Page size.
+        after: string, optional query parameter. nextCursor of
+               the previous page.
+        stream: 'true', optional query parameter. Streams the
+                full listing instead of building it in memory.
+        If-None-Match / If-Modified-Since headers: optional.
+                Validators of a previous response.
     Expected Output:
+         304 Not Modified when the person table did not change.
          list of all peope from database when successful.
          total number of people
          Error otherwise.
+         When limit or after is given, one page of people
+         ordered by id and the nextCursor (null on the last page).
     ***********************************************************
     -----------------------------------------------------------
     Required Permissions: list_all_people
@@ -112,15 +164,40 @@ def create_app(test_config=None):
     @app.route('/people', methods=['GET'])
     @requires_auth('list_all_people')
     def people(payload):
-        try:
+        if wants_stream():
+            etag, last_modified = get_collection_etag('person')
+            response = not_modified(etag, last_modified)
+            if response is not None:
+                return response
+            response = Response(stream_with_context(stream_people()),
+                                mimetype='application/json')
+            return set_validators(response, etag, last_modified)
+
+        def validators():
+            return get_collection_etag('person')
+
+        page = get_page_args()
+        if page is not None:
+            def build_page():
+                people, next_cursor = get_people_page(*page)
+                return {'success': True,
+                        'people': people,
+                        'nextCursor': next_cursor}
+            return cached_json_response('people', ('person',),
+                                        validators, build_page)
+
+        def build():
             people = get_people()
+            return {'success': True,
+                    'people': people,
+                    'totalPeople': len(people)}
+        try:
+            return cached_json_response('people', ('person',),
+                                        validators, build)
         except Exception as e:
             print(e)
             return jsonify({'success': False,
                             'message': e})
-        return jsonify({'success': True,
-                        'people': people,
-                        'totalPeople': len(people)})
 
     '''
     -----------------------------------------------------------
@@ -130,9 +207,11 @@ def create_app(test_config=None):
     ***********************************************************
     Expected Inputs:
       description: string. Task description
+      Prefer header: optional. return=representation or return=minimal
     Expected Output:
       list of all tasks from database
       total number of tasks in the database
+      With a Prefer header only the new task (201), or nothing (204)
     ***********************************************************
     -----------------------------------------------------------
     Required Permissions: add_task
@@ -144,15 +223,60 @@ def create_app(test_config=None):
     '''
     @app.route('/tasks', methods=['POST'])
     @requires_auth('add_task')
-    def add_task(payload):
-        description = request.get_json()['description']
-        task = taskLookup(description)
-        if task is not None:
-            abort(422)
+    @json_body(description=string)
+    def add_task(payload, description):
         task = Task(description=description)
-        task.insert()
+        try:
+            task.insert()
+        except IntegrityError:
+            # uq_task: a task with this description already exists
+            db.session.rollback()
+            abort(422)
+        preference = get_return_preference()
+        if preference is not None:
+            return resource_response(preference, 'task', task.format(), 201)
         return redirect(url_for('tasks'))
 
+    '''
+    -----------------------------------------------------------
+    This endpoint handles creation of many tasks via POST.
+    Existing descriptions are looked up in one query and the
+    new ones are inserted in one statement and one commit.
+    -----------------------------------------------------------
+    ***********************************************************
+    Expected Inputs:
+      descriptions: list of strings. Task descriptions,
+                    at most 1000.
+    Expected Output:
+      status ('created' or 'duplicate') for each description
+      number of tasks created
+      number of duplicates
+    ***********************************************************
+    -----------------------------------------------------------
+    Required Permissions: add_task
+    -----------------------------------------------------------
+    -----------------------------------------------------------
+    Linked tests:test_add_tasks_bulk
+    -----------------------------------------------------------
+    '''
+    @app.route('/tasks/bulk', methods=['POST'])
+    @requires_auth('add_task')
+    def add_tasks_bulk(payload):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        try:
+            results = bulk_add_tasks(body.get('descriptions'))
+        except IntegrityError:
+            # A concurrent request created one of the descriptions
+            db.session.rollback()
+            abort(422)
+        created = sum(1 for r in results if r['status'] == 'created')
+        return jsonify({'success': True,
+                        'tasks': results,
+                        'created': created,
+                        'duplicates': len(results) - created})
+
     '''
     -----------------------------------------------------------
     This endpoint handles creation of new person via POST
@@ -164,9 +288,11 @@ def create_app(test_config=None):
                     separated by comma
       name: ssn.  ssn. Name and SSN together uniquely
                     Identify a person.
+      Prefer header: optional. return=representation or return=minimal
     Expected Output:
       list of all people from database
       total number of people in the database
+      With a Prefer header only the new person (201), or nothing (204)
     ***********************************************************
     -----------------------------------------------------------
     Required Permissions: add_person
@@ -178,17 +304,70 @@ def create_app(test_config=None):
     '''
     @app.route('/people', methods=['POST'])
     @requires_auth('add_person')
-    def add_person(payload):
+    @json_body(name=string, ssn=string)
+    def add_person(payload, name, ssn):
         try:
-            name = request.get_json()['name']
-            ssn = request.get_json()['ssn']
             person = Person(name=name, ssn=ssn)
             person.insert()
+        except IntegrityError:
+            # uq_person: this name and ssn are already registered
+            db.session.rollback()
+            abort(422)
         except Exception as e:
             print(e)
             return jsonify({'message': e})
+        preference = get_return_preference()
+        if preference is not None:
+            return resource_response(preference, 'person',
+                                     person.format(), 201)
         return redirect(url_for('people'))
 
+    '''
+    -----------------------------------------------------------
+    This endpoint handles importing many people via POST.
+    The body is streamed row by row and written in batches,
+    using COPY on PostgreSQL.
+    -----------------------------------------------------------
+    ***********************************************************
+    Expected Inputs:
+      body: CSV with a 'name,ssn' header (Content-Type: text/csv)
+            or one JSON object per line with name and ssn
+            (Content-Type: application/x-ndjson)
+      batch_size: int, optional query parameter. Rows written
+                  per transaction (1-10000, default 1000).
+    Expected Output:
+      number of people inserted
+      number of duplicates (already existing name and ssn)
+      number of rejected rows and the first rejected line numbers
+      400 for a body that is not UTF-8
+    ***********************************************************
+    -----------------------------------------------------------
+    Required Permissions: add_person
+    -----------------------------------------------------------
+    -----------------------------------------------------------
+    Linked tests:test_import_people
+    -----------------------------------------------------------
+    '''
+    @app.route('/people/import', methods=['POST'])
+    @requires_auth('add_person')
+    def import_people(payload):
+        if request.mimetype not in ('text/csv', 'application/x-ndjson'):
+            abort(400)
+        try:
+            batch_size = int(request.args.get('batch_size',
+                                              IMPORT_BATCH_SIZE))
+        except ValueError:
+            abort(400)
+        if batch_size < 1 or batch_size > 10000:
+            abort(400)
+        try:
+            summary = import_people_stream(request.stream,
+                                           request.mimetype, batch_size)
+        except IntegrityError:
+            db.session.rollback()
+            abort(422)
+        return jsonify(dict(summary, success=True))
+
     '''
     -----------------------------------------------------------
     This endpoint to handles POST requests to assign task to
@@ -203,8 +382,12 @@ def create_app(test_config=None):
         dueBy: datetime. Date by when the task is need to be
                          completed.
         status: string. Current state of the tasks.
+        Prefer header: optional. return=representation or
+                       return=minimal
     Expected Output:
          list of all tasks from database when successful.
+         With a Prefer header only the new assignment (201),
+         or nothing (204).
          Error otherwise.
     ***********************************************************
     -----------------------------------------------------------
@@ -216,13 +399,10 @@ def create_app(test_config=None):
     '''
     @app.route('/people/assign_task', methods=['POST'])
     @requires_auth('assign_task')
-    def assign_task(payload):
+    @json_body(personId=integer, taskId=integer, startDate=parse_datetime,
+               dueBy=parse_datetime, status=string)
+    def assign_task(payload, personId, taskId, startDate, dueBy, status):
         try:
-            personId = request.get_json()['personId']
-            taskId = request.get_json()['taskId']
-            startDate = request.get_json()['startDate']
-            dueBy = request.get_json()['dueBy']
-            status = request.get_json()['status']
             personTask = PersonTask(personid=personId, taskid=taskId,
                                     startdate=startDate, dueby=dueBy,
                                     status=status)
@@ -231,8 +411,48 @@ def create_app(test_config=None):
             print(e)
             return jsonify({'success': False,
                             'message': e})
+        preference = get_return_preference()
+        if preference is not None:
+            return resource_response(preference, 'personTask',
+                                     personTask.format(), 201)
         return redirect(url_for('tasks'))
 
+    '''
+    -----------------------------------------------------------
+    This endpoint to handles POST requests to assign many tasks
+    to many people in one transaction.
+    -----------------------------------------------------------
+    ***********************************************************
+    Expected Inputs, either:
+        assignments: list of {personId, taskId, startDate, dueBy,
+                     status} objects, as for /people/assign_task
+    or a cross product:
+        personIds: list of int. People to assign the tasks to.
+        taskIds: list of int. Tasks to assign to every person.
+        startDate, dueBy, status: as for /people/assign_task
+    At most 10000 assignments. status defaults to Not_Started.
+    Expected Output:
+         result for each assignment: 'created', 'conflict'
+         (already assigned with this start date) or 'invalid'
+         (unknown person/task or malformed fields).
+         number of assignments created.
+    ***********************************************************
+    -----------------------------------------------------------
+    Required Permissions: assign_task
+    -----------------------------------------------------------
+    -----------------------------------------------------------
+    Linked tests:test_assign_tasks_bulk
+    -----------------------------------------------------------
+    '''
+    @app.route('/people/assign_tasks', methods=['POST'])
+    @requires_auth('assign_task')
+    def assign_tasks(payload):
+        body = request.get_json(silent=True)
+        results, created = bulk_assign_tasks(body)
+        return jsonify({'success': True,
+                        'assignments': results,
+                        'created': created})
+
     '''
     -----------------------------------------------------------
     This endpoint to handles PATCH requests for tasks.
@@ -246,9 +466,13 @@ def create_app(test_config=None):
         taskId: int. Id of the task being updated.
         startDate: datetime. Expected start date of the task.
         status: string. Updated state of the tasks.
+        Prefer header: optional. return=representation or
+                       return=minimal
     Expected Output:
       list of all tasks from database
       total number of tasks
+      With a Prefer header only the updated assignment,
+      or nothing (204)
     ***********************************************************
     -----------------------------------------------------------
     Required Permissions: update_task_status
@@ -259,12 +483,9 @@ def create_app(test_config=None):
     '''
     @app.route('/people/update_task_status', methods=['PATCH'])
     @requires_auth('update_task_status')
-    def update_task_status(payload):
-        personId = request.get_json()['personId']
-        taskId = request.get_json()['taskId']
-        startDate = request.get_json()['startDate']
-        status = request.get_json()['status']
-
+    @json_body(personId=integer, taskId=integer, startDate=parse_datetime,
+               status=string)
+    def update_task_status(payload, personId, taskId, startDate, status):
         personTask = PersonTask.query.filter(PersonTask.personid == personId,
                                              PersonTask.taskid == taskId,
                                              PersonTask.startdate == startDate
@@ -274,11 +495,48 @@ def create_app(test_config=None):
             abort(404)
         personTask.status = status
         personTask.update()
+        preference = get_return_preference()
+        if preference is not None:
+            return resource_response(preference, 'personTask',
+                                     personTask.format())
         tasks = get_tasks()
         return jsonify({'success': True,
                         'tasks': tasks,
                         'totalTasks': len(tasks)})
 
+    '''
+    -----------------------------------------------------------
+    This endpoint to handles PATCH requests to update the
+    status of many assignments at once.
+    -----------------------------------------------------------
+    ***********************************************************
+    Expected Inputs:
+        updates: list of {personId, taskId, startDate, status}
+                 objects identifying an assignment and its new
+                 status. At most 10000.
+    Expected Output:
+      result for each update: 'updated', 'not_found' or
+      'invalid' (malformed fields)
+      number of assignments updated
+    ***********************************************************
+    -----------------------------------------------------------
+    Required Permissions: update_task_status
+    -----------------------------------------------------------
+    -----------------------------------------------------------
+    Linked tests:test_update_task_statuses
+    -----------------------------------------------------------
+    '''
+    @app.route('/people/update_task_statuses', methods=['PATCH'])
+    @requires_auth('update_task_status')
+    def update_task_statuses(payload):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        results, updated = bulk_update_task_statuses(body.get('updates'))
+        return jsonify({'success': True,
+                        'updates': results,
+                        'updated': updated})
+
     '''
     -----------------------------------------------------------
     This endpoint to handles GET requests for all tasks
@@ -286,8 +544,16 @@ def create_app(test_config=None):
     -----------------------------------------------------------
     ***********************************************************
     Expected Inputs: id of the user
+        status: string, optional query parameter. Only tasks
+                with this status.
+        dueAfter, dueBefore: datetime, optional query parameters.
+                Only tasks due in this range.
+        If-None-Match header: optional, on GET. ETag of a
+                previous response.
     Expected Output:
-         list of all tasks from database when successful.
+         list of all tasks of the user, with task descriptions,
+         ordered by due date when successful, with an ETag.
+         304 Not Modified on GET when If-None-Match matches.
          Error otherwise.
     ***********************************************************
     -----------------------------------------------------------
@@ -297,18 +563,34 @@ def create_app(test_config=None):
     Linked tests:test_list_user_tasks
     -----------------------------------------------------------
     '''
-    @app.route('/people/<int:user_id>/tasks', methods=['POST'])
+    @app.route('/people/<int:user_id>/tasks', methods=['GET', 'POST'])
     @requires_auth('list_user_tasks')
     def user_tasks(payload, user_id):
+        filters = get_user_task_filters()
+
+        def validators():
+            etag = get_user_tasks_etag(user_id, **filters)
+            if etag is None:
+                abort(404)
+            return etag, None
+
+        def build():
+            return {'success': True,
+                    'user': user_id,
+                    'user_tasks': get_user_tasks(user_id, **filters)}
         try:
-            tasks = get_user_tasks(user_id)
+            response = cached_json_response(
+                'user_tasks', ('persontasks', 'task'),
+                validators, build, user_id)
+        except HTTPException:
+            raise
         except Exception as e:
             print(e)
             return jsonify({'success': False,
-                            'message': e})
-        return jsonify({'success': True,
-                        'user': user_id,
-                        'user_tasks': tasks})
+                            'message': 'error'})
+        # Per-user data: browsers may keep it but must revalidate
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
 
     '''
     -----------------------------------------------------------
@@ -317,9 +599,11 @@ def create_app(test_config=None):
     -----------------------------------------------------------
     ***********************************************************
     Expected Inputs: id of the task
+      Prefer header: optional. return=representation or return=minimal
     Expected Output:
       list of all tasks from database
       total number of tasks
+      With a Prefer header only the deleted task, or nothing (204)
     ***********************************************************
     -----------------------------------------------------------
     Required Permissions: delete_task
@@ -334,8 +618,12 @@ def create_app(test_config=None):
         task = Task.query.filter(Task.id == task_id).one_or_none()
         if task is None:
             abort(404)
+        preference = get_return_preference()
+        deleted = task.format()
         try:
             task.delete()
+            if preference is not None:
+                return resource_response(preference, 'task', deleted)
             tasks = get_tasks()
         except Exception as e:
             print(e)
@@ -352,9 +640,11 @@ def create_app(test_config=None):
     -----------------------------------------------------------
     ***********************************************************
     Expected Inputs: id of the person
+      Prefer header: optional. return=representation or return=minimal
     Expected Output:
       list of all people from database
       total number of tasks
+      With a Prefer header only the deleted person, or nothing (204)
     ***********************************************************
     -----------------------------------------------------------
     Required Permissions: delete_person
@@ -369,8 +659,12 @@ def create_app(test_config=None):
         person = Person.query.filter(Person.id == person_id).one_or_none()
         if person is None:
             abort(404)
+        preference = get_return_preference()
+        deleted = person.format()
         try:
             person.delete()
+            if preference is not None:
+                return resource_response(preference, 'person', deleted)
             people = get_people()
         except Exception as e:
             print(e)
@@ -449,8 +743,8 @@ def create_app(test_config=None):
     -----------------------------------------------------------
     '''
     @app.route('/tasks/find', methods=['POST'])
-    def find_task():
-        description = request.get_json()['description']
+    @json_body(description=string)
+    def find_task(description):
         task = taskLookup(description)
         if task is None:
             abort(404)
@@ -474,22 +768,72 @@ def create_app(test_config=None):
     -----------------------------------------------------------
     '''
     @app.route('/people/find', methods=['POST'])
-    def find_person():
-        name = request.get_json()['name']
-        ssn = request.get_json()['ssn']
+    @json_body(name=string, ssn=string)
+    def find_person(name, ssn):
         person = personLookup(name, ssn)
         if person is None:
             abort(404)
         return jsonify({'success': True,
                         'id': person.id})
 
+    '''
+    Metrics endpoints expose worker internals (pid, pool state,
+    cache sizes): they are only registered when METRICS_ENABLED
+    (app config or environment) is set, and need a valid token.
+    '''
+    if get_setting(app.config, 'METRICS_ENABLED', parse_flag, False):
+        '''
+        -----------------------------------------------------------
+        This endpoint reports hit ratios of the response cache
+        and the token cache of this worker
+        -----------------------------------------------------------
+        ***********************************************************
+        Expected Inputs:
+          Authorization header: bearer token.
+        Expected Output:
+          responseCache and tokenCache counters (hits, misses,
+          hitRatio, ...).
+        ***********************************************************
+        -----------------------------------------------------------
+        Linked tests:test_response_cache, test_metrics_auth
+        -----------------------------------------------------------
+        '''
+        @app.route('/metrics/cache', methods=['GET'])
+        @requires_auth()
+        def cache_metrics(payload):
+            return jsonify({'success': True,
+                            'responseCache': response_cache.stats(),
+                            'tokenCache': token_cache.stats()})
+
+        '''
+        -----------------------------------------------------------
+        This endpoint reports the database connection pool of
+        this worker
+        -----------------------------------------------------------
+        ***********************************************************
+        Expected Inputs:
+          Authorization header: bearer token.
+        Expected Output:
+          connections checked out and idle, overflow, checkout
+          count and time, timeouts and invalidated connections.
+        ***********************************************************
+        -----------------------------------------------------------
+        Linked tests:test_pool_metrics, test_metrics_auth
+        -----------------------------------------------------------
+        '''
+        @app.route('/metrics/pool', methods=['GET'])
+        @requires_auth()
+        def pool_metrics(payload):
+            return jsonify({'success': True,
+                            'pool': pool_stats(db.engine)})
+
     '''***********************************************************
     '''
 
     return app
 
 
-app = create_app()
-
+# No module-level app: importing this module neither reads DATABASE_URL
+# nor connects. gunicorn builds the app from wsgi.py.
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
@@ -1,5 +1,9 @@
 import os
 import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
@@ -19,6 +23,18 @@ TOKEN_EXPIRATION = os.environ.get('TOKEN_EXPIRATION')
 TOKEN_EXPIRATION_BROWSER = os.environ.get('TOKEN_EXPIRATION_BROWSER')
 ENABLE_RBAC = os.environ.get('ENABLE_RBAC')
 ADD_PERMISSIONS_TO_TOKEN = os.environ.get('ADD_PERMISSIONS_TO_TOKEN')
+# Seconds a fetched key set is considered fresh
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 600))
+# Minimum seconds between refreshes triggered by an unknown kid
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+# Maximum number of verified tokens kept in memory
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+# 'auth0' verifies against Auth0, 'local' against LOCAL_JWKS_FILE
+AUTH_MODE = os.environ.get('AUTH_MODE', 'auth0')
+LOCAL_JWKS_FILE = os.environ.get('LOCAL_JWKS_FILE', 'local_jwks.json')
+LOCAL_ISSUER = os.environ.get('LOCAL_ISSUER', 'https://choremosta.local/')
 
 
 # Login URL:
@@ -83,28 +99,60 @@ def get_token_auth_header():
 
 
 '''
-check_permissions(permission, payload)
+Principal
+The authenticated caller, normalized once from a decoded jwt payload.
+    payload: the decoded jwt payload
+    subject: the 'sub' claim
+    permissions: frozenset of the 'permissions' claim,
+                 None when the claim is missing
+'''
+
+
+class Principal:
+    def __init__(self, payload):
+        self.payload = payload
+        self.subject = payload.get('sub')
+        self.exp = payload.get('exp')
+        permissions = payload.get('permissions')
+        self.permissions = (frozenset(permissions)
+                            if permissions is not None else None)
+
+    def __repr__(self):
+        return f'<Principal {self.subject}>'
+
+
+'''
+check_permissions(permission, payload, match)
     @INPUTS
         permission: string permission (i.e. 'post:drink')
-        payload: decoded jwt payload
+                    or an iterable of permission strings
+        payload: decoded jwt payload or a Principal
+        match: 'all' (default) or 'any' of the permissions
 
     Raises an AuthError if permissions are not included in the payload
-    Raises an AuthError if the requested permission string is not
-    in the payload permissions array. Returns true otherwise
+    Raises an AuthError if the requested permission strings are not
+    in the payload permissions set. Returns true otherwise
 '''
 
 
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, match='all'):
+    principal = (payload if isinstance(payload, Principal)
+                 else Principal(payload))
     # raise an AuthError if permissions are not included in the payload
-    if 'permissions' not in payload:
+    if principal.permissions is None:
         raise AuthError({
                             'code': 'invalid_claims',
                             'description': 'Permissions not included in JWT.'
                         }, 400)
-    # raise an AuthError if the requested permission string is
-    # not in the payload permissions array
-    if permission not in payload['permissions']:
-        # print('cant find', permission)
+    required = (permission,) if isinstance(permission, str) else permission
+    # raise an AuthError if the requested permission strings are
+    # not in the payload permissions set
+    if match == 'any':
+        granted = not required or any(
+            p in principal.permissions for p in required)
+    else:
+        granted = all(p in principal.permissions for p in required)
+    if not granted:
         raise AuthError({
                         'code': 'unauthorized',
                         'description': 'Permission not in payload.'
@@ -112,13 +160,247 @@ def check_permissions(permission, payload):
     return True
 
 
+'''
+JWKSCache
+Process-wide cache of the signing keys published at
+Auth0 /.well-known/jwks.json, keyed by key id (kid).
+    Keys are served from memory for JWKS_CACHE_TTL seconds.
+    Once the TTL has passed the cached keys keep being served
+    while a single background thread refreshes them.
+    An unknown kid triggers one synchronous refresh; concurrent
+    misses wait on the same refresh instead of each fetching.
+    A failed refresh never drops the keys already held.
+'''
+
+
+class JWKSCache:
+    def __init__(self, fetch, ttl=JWKS_CACHE_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.fetched_at = None
+        self.last_attempt = None
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def get_key(self, kid):
+        key = self.keys.get(kid)
+        if key is not None:
+            if self.is_stale() and self.can_refresh():
+                self.refresh_in_background()
+            return key
+        # Unknown kid: refresh once, shared by all waiting callers
+        with self.lock:
+            key = self.keys.get(kid)
+            if key is None and self.can_refresh():
+                self._refresh()
+                key = self.keys.get(kid)
+        return key
+
+    def is_stale(self):
+        return (self.fetched_at is None or
+                time.monotonic() - self.fetched_at > self.ttl)
+
+    def can_refresh(self):
+        return (self.last_attempt is None or
+                time.monotonic() - self.last_attempt >=
+                self.min_refresh_interval)
+
+    def refresh_in_background(self, throttle_failure=True):
+        # A held lock means a refresh is already under way
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            thread = threading.Thread(target=self._background_refresh,
+                                      args=(throttle_failure,))
+            thread.daemon = True
+            thread.start()
+        except Exception:
+            self.lock.release()
+            raise
+
+    def _background_refresh(self, throttle_failure=True):
+        # Runs with self.lock handed over by refresh_in_background
+        try:
+            if not self._refresh() and not throttle_failure:
+                self.last_attempt = None
+        finally:
+            self.lock.release()
+
+    def prefetch(self):
+        '''
+        Fetches the keys in the background, e.g. when a worker
+        starts. If it fails, the first request needing a key may
+        retry at once instead of waiting min_refresh_interval.
+        '''
+        if not self.keys:
+            self.refresh_in_background(throttle_failure=False)
+
+    def _refresh(self):
+        # Caller must hold self.lock
+        self.last_attempt = time.monotonic()
+        try:
+            jwks = self.fetch()
+        except Exception as e:
+            # Keep serving whatever we already have
+            print(e)
+            return False
+        keys = {}
+        for key in jwks['keys']:
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+        removed = set(self.keys) - set(keys)
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+        for listener in self.listeners:
+            listener(removed)
+        return True
+
+    def on_refresh(self, listener):
+        '''
+        Registers listener(removed_kids), called after every
+        successful refresh with the kids no longer published.
+        '''
+        self.listeners.append(listener)
+        return listener
+
+    def clear(self):
+        with self.lock:
+            removed = set(self.keys)
+            self.keys = {}
+            self.fetched_at = None
+            self.last_attempt = None
+        for listener in self.listeners:
+            listener(removed)
+
+
+def fetch_auth0_jwks():
+    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+                      timeout=JWKS_FETCH_TIMEOUT)
+    return json.loads(jsonurl.read())
+
+
+def fetch_local_jwks():
+    with open(LOCAL_JWKS_FILE) as jsonfile:
+        return json.load(jsonfile)
+
+
+if AUTH_MODE == 'local':
+    ISSUER = LOCAL_ISSUER
+    jwks_cache = JWKSCache(fetch_local_jwks)
+else:
+    ISSUER = f'https://{AUTH0_DOMAIN}/'
+    jwks_cache = JWKSCache(fetch_auth0_jwks)
+
+
+'''
+TokenCache
+Bounded LRU cache of verified tokens.
+    Keyed by the sha256 of the raw token so tokens are not kept
+    in memory. Holds the verified Principal until the token's exp.
+    Entries signed with a key that is no longer published are
+    evicted when the JWKS cache refreshes.
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def token_key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self.token_key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token, principal, kid):
+        exp = principal.exp
+        if self.maxsize <= 0 or not isinstance(exp, (int, float)):
+            return
+        key = self.token_key(token)
+        with self.lock:
+            self.entries[key] = (principal, exp, kid)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def evict_kids(self, kids):
+        if not kids:
+            return
+        with self.lock:
+            for key in [key for key, entry in self.entries.items()
+                        if entry[2] in kids]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRatio': self.hits / lookups if lookups else 0.0
+        }
+
+
+token_cache = TokenCache()
+jwks_cache.on_refresh(token_cache.evict_kids)
+
+
+'''
+use_local_keys(jwks, issuer) method
+    @INPUTS
+        jwks: a key set in /.well-known/jwks.json format
+        issuer: expected 'iss' claim of the tokens
+
+    Switches token verification to an in-memory key set,
+    e.g. one created by auth.local.generate_key_pair(),
+    so no request is made to Auth0.
+'''
+
+
+def use_local_keys(jwks, issuer=LOCAL_ISSUER):
+    global ISSUER
+    ISSUER = issuer
+    jwks_cache.fetch = lambda: jwks
+    jwks_cache.clear()
+    token_cache.clear()
+
+
 '''
 verify_decode_jwt(token) method
     @INPUTS
         token: a json web token (string)
 
     it should be an Auth0 token with key id (kid)
-    Verifies the token using Auth0 /.well-known/jwks.json
+    Verifies the token using the cached Auth0 /.well-known/jwks.json
+    (or the local key set when AUTH_MODE is 'local')
     Decodes the payload from the token
     Validates the claims
     returns the decoded payload
@@ -126,29 +408,16 @@ verify_decode_jwt(token) method
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     # Get Header
     unverified_header = jwt.get_unverified_header(token)
-    # Whats the key?
-    rsa_key = {}
     # check it is an Auth0 token with key id (kid)
     if 'kid' not in unverified_header:
         raise AuthError({
                             'code': 'invalid_header',
                             'description': 'Authorization malformed.'
                         }, 401)
-    for key in jwks['keys']:
-        # verify the token using Auth0 /.well-known/jwks.json
-        if key['kid'] == unverified_header['kid']:
-            # decode the payload from the token
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    # verify the token using Auth0 /.well-known/jwks.json
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
     # What do we have here?
     if rsa_key:
         # validate the claims
@@ -159,10 +428,8 @@ def verify_decode_jwt(token):
                 rsa_key,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                issuer=ISSUER
             )
-            # return the decoded payload
-            return payload
         except jwt.ExpiredSignatureError:
             raise AuthError({
                                 'code': 'token_expired',
@@ -178,6 +445,8 @@ def verify_decode_jwt(token):
                 'code': 'invalid_header',
                 'description': 'Unable to parse authentication token.'
                 }, 400)
+        # return the decoded payload
+        return payload
     raise AuthError({
                         'code': 'invalid_header',
                         'description': 'Unable to find the appropriate key.'
@@ -185,27 +454,58 @@ def verify_decode_jwt(token):
 
 
 '''
-@requires_auth(permission) decorator method
+get_principal(token) method
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
+        token: a json web token (string)
+
+    Returns the cached Principal if the token was already verified
+    Otherwise calls verify_decode_jwt, normalizes the payload into
+    a Principal and caches it until the token expires
+'''
+
 
+def get_principal(token):
+    principal = token_cache.get(token)
+    if principal is None:
+        payload = verify_decode_jwt(token)
+        principal = Principal(payload)
+        kid = jwt.get_unverified_header(token)['kid']
+        token_cache.put(token, principal, kid)
+    return principal
+
+
+'''
+@requires_auth(*permissions, match='all') decorator method
+    @INPUTS
+        permissions: string permissions (i.e. 'post:drink')
+        match: 'all' to require every permission,
+               'any' to require at least one of them
+
+    With no permissions, requires_auth() admits any valid token
+    that has a permissions claim. (Before, requires_auth() with no
+    argument required the '' permission.)
     Uses the get_token_auth_header method to get the token
-    Calls the verify_decode_jwt method to decode the jwt
+    Calls the get_principal method to decode the jwt
     Calls the check_permissions method validate claims
-    and check the requested permission
+    and check the requested permissions
+    Attaches the Principal to the request as current_user
     returns the decorator which passes the decoded
     payload to the decorated method
 '''
 
 
-def requires_auth(permission=''):
+def requires_auth(*permissions, match='all'):
+    if match not in ('all', 'any'):
+        raise ValueError(f'Unknown permission match: {match}')
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            principal = get_principal(token)
+            check_permissions(permissions, principal, match)
+            _request_ctx_stack.top.current_user = principal
+            return f(principal.payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
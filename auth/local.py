@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import argparse
+import rsa
+from jose import jwk, jwt
+
+from auth.auth import API_AUDIENCE, LOCAL_ISSUER, LOCAL_JWKS_FILE, \
+    use_local_keys
+
+'''
+Local signing keys and tokens.
+Used to run the API without Auth0, e.g. for load testing:
+
+    python -m auth.local > local_env.sh
+    source local_env.sh
+
+writes a key pair (LOCAL_PRIVATE_KEY_FILE, LOCAL_JWKS_FILE) if
+missing and prints the exports that switch auth.auth to local mode
+together with parent_user and child_user tokens.
+'''
+
+LOCAL_PRIVATE_KEY_FILE = os.environ.get('LOCAL_PRIVATE_KEY_FILE',
+                                        'local_key.pem')
+LOCAL_KID = 'choremosta-local'
+ALGORITHM = 'RS256'
+
+# Same permissions as the Auth0 'Parent' and 'Child' roles
+PARENT_PERMISSIONS = [
+    'add_person', 'add_task', 'assign_task', 'delete_person',
+    'delete_task', 'list_all_people', 'list_all_tasks',
+    'list_user_tasks', 'update_task_status'
+]
+CHILD_PERMISSIONS = ['list_user_tasks', 'update_task_status']
+ROLES = {'parent': PARENT_PERMISSIONS, 'child': CHILD_PERMISSIONS}
+
+
+'''
+generate_key_pair(kid, bits) method
+    Returns the private key (PEM string) and the matching public
+    key set in /.well-known/jwks.json format.
+'''
+
+
+def generate_key_pair(kid=LOCAL_KID, bits=2048):
+    _, private_key = rsa.newkeys(bits)
+    private_pem = private_key.save_pkcs1().decode('utf-8')
+    return private_pem, public_jwks(private_pem, kid)
+
+
+def public_jwks(private_pem, kid=LOCAL_KID):
+    key = jwk.construct(private_pem, ALGORITHM).public_key().to_dict()
+    key.update({'kid': kid, 'use': 'sig'})
+    return {'keys': [key]}
+
+
+'''
+load_or_create_keys(private_key_file, jwks_file) method
+    Reads the private key from private_key_file, generating it if
+    missing, and (re)writes the public key set to jwks_file.
+    Returns the private key (PEM string).
+'''
+
+
+def load_or_create_keys(private_key_file=LOCAL_PRIVATE_KEY_FILE,
+                        jwks_file=LOCAL_JWKS_FILE):
+    if os.path.exists(private_key_file):
+        with open(private_key_file) as pemfile:
+            private_pem = pemfile.read()
+        jwks = public_jwks(private_pem)
+    else:
+        private_pem, jwks = generate_key_pair()
+        with open(private_key_file, 'w') as pemfile:
+            pemfile.write(private_pem)
+        os.chmod(private_key_file, 0o600)
+    with open(jwks_file, 'w') as jsonfile:
+        json.dump(jwks, jsonfile)
+    return private_pem
+
+
+'''
+mint_token(private_pem, role, permissions, ...) method
+    Issues an RS256 token signed with private_pem carrying the
+    permissions of role ('parent' or 'child'), or the given
+    permissions list when provided.
+'''
+
+
+def mint_token(private_pem, role='parent', permissions=None,
+               subject=None, expires_in=86400, kid=LOCAL_KID,
+               issuer=LOCAL_ISSUER, audience=API_AUDIENCE):
+    now = int(time.time())
+    claims = {
+        'iss': issuer,
+        'sub': subject or f'local|{role}',
+        'iat': now,
+        'exp': now + expires_in,
+        'scope': '',
+        'permissions': list(ROLES[role] if permissions is None
+                            else permissions)
+    }
+    if audience:
+        claims['aud'] = audience
+    return jwt.encode(claims, private_pem, algorithm=ALGORITHM,
+                      headers={'kid': kid})
+
+
+'''
+use_in_memory_keys() method
+    Generates a throwaway key pair, makes auth.auth verify tokens
+    against it and returns the private key for mint_token.
+'''
+
+
+def use_in_memory_keys(issuer=LOCAL_ISSUER):
+    private_pem, jwks = generate_key_pair()
+    use_local_keys(jwks, issuer)
+    return private_pem
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Create local signing keys and print test tokens.')
+    parser.add_argument('--private-key', default=LOCAL_PRIVATE_KEY_FILE)
+    parser.add_argument('--jwks', default=LOCAL_JWKS_FILE)
+    parser.add_argument('--expires-in', type=int, default=86400)
+    args = parser.parse_args(argv)
+
+    private_pem = load_or_create_keys(args.private_key, args.jwks)
+    print("export AUTH_MODE='local'")
+    print(f"export LOCAL_JWKS_FILE='{os.path.abspath(args.jwks)}'")
+    print(f"export LOCAL_ISSUER='{LOCAL_ISSUER}'")
+    for role in ROLES:
+        token = mint_token(private_pem, role, expires_in=args.expires_in)
+        print(f"export {role}_user='{token}'")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
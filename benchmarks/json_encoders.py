@@ -0,0 +1,85 @@
+'''
+Benchmark: JSON providers for listing responses.
+
+Encodes /tasks and /people/<id>/tasks shaped payloads of --rows rows
+(default 10000 and 100000) with every available provider of
+serialization.py and prints the median time and the payload size:
+    stdlib http: Flask's encoder, the previous behaviour
+    orjson http: orjson, datetimes in Flask's format
+    orjson iso:  orjson, native ISO 8601 datetimes
+
+    python benchmarks/json_encoders.py --rows 10000 100000
+
+No database is needed.
+'''
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from serialization import StdlibProvider, OrjsonProvider, orjson
+
+
+def tasks_payload(rows):
+    tasks = [{'id': i, 'description': f'task number {i}'}
+             for i in range(1, rows + 1)]
+    return {'success': True, 'tasks': tasks, 'totalTasks': rows}
+
+
+def user_tasks_payload(rows):
+    start = datetime(2020, 1, 1)
+    tasks = [{'personId': 1,
+              'taskId': i,
+              'description': f'task number {i}',
+              'startDate': start + timedelta(minutes=i),
+              'dueBy': start + timedelta(days=1, minutes=i),
+              'status': 'Pending'}
+             for i in range(1, rows + 1)]
+    return {'success': True, 'user': 1, 'user_tasks': tasks}
+
+
+def providers():
+    found = [('stdlib http', StdlibProvider('http'))]
+    if orjson is not None:
+        found += [('orjson http', OrjsonProvider('http')),
+                  ('orjson iso', OrjsonProvider('iso'))]
+    return found
+
+
+def measure(provider, payload, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = provider.dumps(payload)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, len(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    if orjson is None:
+        print('orjson is not installed, only the stdlib provider is run')
+
+    print(f'{"payload":<12}{"rows":>8}  {"provider":<14}'
+          f'{"median ms":>10}{"KiB":>10}')
+    for rows in args.rows:
+        for name, build in (('tasks', tasks_payload),
+                            ('user_tasks', user_tasks_payload)):
+            payload = build(rows)
+            for label, provider in providers():
+                median, size = measure(provider, payload, args.repeat)
+                print(f'{name:<12}{rows:>8}  {label:<14}'
+                      f'{median:>10.2f}{size / 1024:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
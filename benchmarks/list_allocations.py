@@ -0,0 +1,150 @@
+'''
+Benchmark: ORM instances vs column projections in the list helpers.
+
+Seeds --tasks tasks, --people people and --per-person assignments
+for each person, then runs what GET /tasks, GET /people and
+GET /people/<id>/tasks do per request (read the rows, build the
+dicts, encode the JSON) two ways:
+    orm:        Model.query...all() and format() per instance, the
+                previous lib.py code
+    projection: the column projections now used by lib.py
+and prints the peak memory allocated during one request (traced with
+tracemalloc) and the median time.
+
+    DATABASE_URL=postgresql://... \
+        python benchmarks/list_allocations.py --tasks 100000
+
+The script drops and recreates the app tables: point it at a
+scratch database.
+'''
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask
+from models import db, setup_db, Person, Task, PersonTask
+from serialization import dumps
+import lib
+
+BATCH_SIZE = 10000
+
+
+def seed(engine, args):
+    db.Model.metadata.drop_all(engine)
+    db.Model.metadata.create_all(engine)
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        for first in range(1, args.tasks + 1, BATCH_SIZE):
+            last = min(first + BATCH_SIZE, args.tasks + 1)
+            conn.execute(Task.__table__.insert(), [
+                {'id': i, 'description': f'task number {i}'}
+                for i in range(first, last)])
+        conn.execute(Person.__table__.insert(), [
+            {'id': i, 'name': f'person {i}', 'ssn': str(i)}
+            for i in range(1, args.people + 1)])
+        conn.execute(PersonTask.__table__.insert(), [
+            {'personid': person_id,
+             'taskid': i % args.tasks + 1,
+             'startdate': start + timedelta(hours=i),
+             'dueby': start + timedelta(days=1, hours=i),
+             'status': 'Pending'}
+            for person_id in range(1, args.people + 1)
+            for i in range(args.per_person)])
+
+
+def tasks_orm():
+    tasks = [task.format() for task in Task.query.order_by('id').all()]
+    return {'success': True, 'tasks': tasks, 'totalTasks': len(tasks)}
+
+
+def tasks_projection():
+    tasks = lib.get_tasks()
+    return {'success': True, 'tasks': tasks, 'totalTasks': len(tasks)}
+
+
+def people_orm():
+    people = [person.format()
+              for person in Person.query.order_by('id').all()]
+    return {'success': True, 'people': people, 'totalPeople': len(people)}
+
+
+def people_projection():
+    people = lib.get_people()
+    return {'success': True, 'people': people, 'totalPeople': len(people)}
+
+
+def user_tasks_orm():
+    rows = db.session.query(Person.id, PersonTask, Task.description) \
+        .select_from(Person) \
+        .outerjoin(PersonTask, PersonTask.personid == Person.id) \
+        .outerjoin(Task, Task.id == PersonTask.taskid) \
+        .filter(Person.id == 1) \
+        .order_by(PersonTask.dueby).all()
+    tasks = [dict(task.format(), description=description)
+             for _, task, description in rows if task is not None]
+    return {'success': True, 'user': 1, 'user_tasks': tasks}
+
+
+def user_tasks_projection():
+    return {'success': True, 'user': 1, 'user_tasks': lib.get_user_tasks(1)}
+
+
+def request(build):
+    try:
+        return len(dumps(build()))
+    finally:
+        # What Flask-SQLAlchemy does at the end of every request
+        db.session.remove()
+
+
+def measure(build, repeat):
+    request(build)
+    tracemalloc.start()
+    request(build)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        request(build)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return peak / 1024, timings[len(timings) // 2] * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--tasks', type=int, default=100000)
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument('--per-person', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    # The tables are created by seed()
+    app.config['SCHEMA_CHECK'] = 'off'
+    setup_db(app, os.environ['DATABASE_URL'])
+    with app.app_context():
+        print(f'Seeding {args.tasks} tasks, {args.people} people and '
+              f'{args.per_person} assignments per person...')
+        seed(db.engine, args)
+
+        print(f'{"listing":<14}{"path":<12}{"peak KiB":>12}'
+              f'{"median ms":>12}')
+        for name, orm, projection in (
+                ('tasks', tasks_orm, tasks_projection),
+                ('people', people_orm, people_projection),
+                ('user_tasks', user_tasks_orm, user_tasks_projection)):
+            for label, build in (('orm', orm), ('projection', projection)):
+                peak, median = measure(build, args.repeat)
+                print(f'{name:<14}{label:<12}{peak:>12.0f}{median:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+'''
+Benchmark: secondary indexes on persontasks.
+
+Seeds person, task and persontasks with --rows assignments and times
+    delete-task: what delete_task does for one task (load its
+                 persontasks by taskid, delete them, delete the task)
+    list-user-tasks: one person's tasks filtered by status,
+                     and ordered by due date
+first without the ix_persontasks_* indexes, then with them.
+Every measured statement runs in a transaction that is rolled back,
+so both passes see the same data.
+
+    DATABASE_URL=postgresql://... \
+        python benchmarks/persontasks_indexes.py --rows 1000000
+
+The script drops and recreates the app tables: point it at a
+scratch database.
+'''
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine, select, text
+from models import db, Person, Task, PersonTask
+
+STATUSES = ['Not_Started', 'Pending', 'Started', 'Done']
+BATCH_SIZE = 10000
+
+
+def seed(engine, rows, people, tasks):
+    db.Model.metadata.drop_all(engine)
+    db.Model.metadata.create_all(engine)
+    for index in PersonTask.__table__.indexes:
+        index.drop(engine)
+
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(Person.__table__.insert(), [
+            {'id': i, 'name': f'person {i}', 'ssn': str(i)}
+            for i in range(1, people + 1)])
+        conn.execute(Task.__table__.insert(), [
+            {'id': i, 'description': f'task {i}'}
+            for i in range(1, tasks + 1)])
+        batch = []
+        for i in range(rows):
+            startdate = start + timedelta(minutes=i)
+            batch.append({
+                'personid': i % people + 1,
+                'taskid': (i // people) % tasks + 1,
+                'startdate': startdate,
+                'dueby': startdate + timedelta(days=random.randint(0, 30)),
+                'status': random.choice(STATUSES)
+            })
+            if len(batch) == BATCH_SIZE:
+                conn.execute(PersonTask.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(PersonTask.__table__.insert(), batch)
+    analyze(engine)
+
+
+def analyze(engine):
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.execute(text('ANALYZE persontasks'))
+
+
+def delete_task(conn, task_id):
+    persontasks = PersonTask.__table__
+    children = conn.execute(select([persontasks]).where(
+        persontasks.c.taskid == task_id)).fetchall()
+    conn.execute(persontasks.delete().where(
+        persontasks.c.taskid == task_id))
+    conn.execute(Task.__table__.delete().where(
+        Task.__table__.c.id == task_id))
+    return len(children)
+
+
+def list_user_tasks_by_status(conn, person_id):
+    persontasks = PersonTask.__table__
+    return conn.execute(select([persontasks]).where(
+        (persontasks.c.personid == person_id) &
+        (persontasks.c.status == 'Pending'))).fetchall()
+
+
+def list_user_tasks_by_due_date(conn, person_id):
+    persontasks = PersonTask.__table__
+    return conn.execute(select([persontasks]).where(
+        persontasks.c.personid == person_id).order_by(
+        persontasks.c.dueby).limit(50)).fetchall()
+
+
+def measure(engine, fn, ids):
+    timings = []
+    for id_ in ids:
+        with engine.connect() as conn:
+            trans = conn.begin()
+            started = time.perf_counter()
+            fn(conn, id_)
+            timings.append(time.perf_counter() - started)
+            trans.rollback()
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, timings[-1] * 1000
+
+
+def run_pass(engine, label, args):
+    task_ids = random.sample(range(1, args.tasks + 1), args.repeat)
+    person_ids = random.sample(range(1, args.people + 1), args.repeat)
+    results = [
+        ('delete-task', measure(engine, delete_task, task_ids)),
+        ('list-user-tasks status', measure(
+            engine, list_user_tasks_by_status, person_ids)),
+        ('list-user-tasks dueby', measure(
+            engine, list_user_tasks_by_due_date, person_ids)),
+    ]
+    for name, (median, worst) in results:
+        print(f'{label:<16}{name:<26}{median:>10.2f}{worst:>10.2f}')
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+    args.repeat = min(args.repeat, args.people, args.tasks)
+
+    engine = create_engine(os.environ['DATABASE_URL'])
+    print(f'Seeding {args.rows} assignments '
+          f'({args.people} people, {args.tasks} tasks)...')
+    seed(engine, args.rows, args.people, args.tasks)
+
+    print(f'{"indexes":<16}{"query":<26}{"median ms":>10}{"max ms":>10}')
+    run_pass(engine, 'without', args)
+    for index in PersonTask.__table__.indexes:
+        index.create(engine)
+    analyze(engine)
+    run_pass(engine, 'with', args)
+
+
+if __name__ == '__main__':
+    main()
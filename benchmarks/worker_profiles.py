@@ -0,0 +1,160 @@
+'''
+Benchmark: sync vs gevent gunicorn workers under many clients.
+
+Seeds --tasks tasks, then for each profile starts `gunicorn wsgi:app`
+(with gunicorn.conf.py, GUNICORN_WORKER_CLASS=<profile>) and keeps
+--clients concurrent clients sending GET --path with a parent token
+for --duration seconds. Prints requests/sec, median and 99th
+percentile latency and failed requests per profile.
+
+Tokens are verified against a local key set (AUTH_MODE=local) and
+the response cache is off, so every request reaches PostgreSQL.
+
+    DATABASE_URL=postgresql://... \
+        python benchmarks/worker_profiles.py --clients 500
+
+The gevent profile needs the gevent and psycogreen packages. The
+script drops and recreates the app tables: point it at a scratch
+database.
+'''
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask
+from models import db, setup_db, create_schema, Task
+from auth.local import load_or_create_keys, mint_token
+
+PROFILES = {'sync': [], 'gevent': ['gevent', 'psycogreen']}
+
+
+def seed(tasks):
+    app = Flask(__name__)
+    app.config['SCHEMA_CHECK'] = 'off'
+    setup_db(app, os.environ['DATABASE_URL'])
+    with app.app_context():
+        db.drop_all()
+        create_schema()
+        with db.engine.begin() as conn:
+            conn.execute(Task.__table__.insert(), [
+                {'id': i, 'description': f'task number {i}'}
+                for i in range(1, tasks + 1)])
+        db.engine.dispose()
+
+
+def start_server(profile, args, jwks_file):
+    env = dict(os.environ,
+               GUNICORN_WORKER_CLASS=profile,
+               WEB_CONCURRENCY=str(args.workers),
+               PORT=str(args.port),
+               DB_POOL_SIZE=str(args.pool_size),
+               AUTH_MODE='local',
+               LOCAL_JWKS_FILE=jwks_file,
+               RESPONSE_CACHE='off')
+    server = subprocess.Popen(['gunicorn', 'wsgi:app'], cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', args.port), 1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'gunicorn ({profile}) did not start')
+
+
+async def client(args, request, stop_at, latencies, failures):
+    while time.monotonic() < stop_at:
+        started = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', args.port)
+            writer.write(request)
+            response = await reader.read()
+            writer.close()
+            if response.startswith(b'HTTP/1.1 200'):
+                latencies.append(time.monotonic() - started)
+            else:
+                failures.append(response.split(b'\r\n', 1)[0])
+        except OSError as e:
+            failures.append(e)
+
+
+async def load(args, token):
+    request = (f'GET {args.path} HTTP/1.1\r\n'
+               f'Host: 127.0.0.1:{args.port}\r\n'
+               f'Authorization: Bearer {token}\r\n'
+               f'Connection: close\r\n\r\n').encode('ascii')
+    latencies = []
+    failures = []
+    stop_at = time.monotonic() + args.duration
+    await asyncio.gather(*[
+        client(args, request, stop_at, latencies, failures)
+        for _ in range(args.clients)])
+    return latencies, failures
+
+
+def run_profile(profile, args, token, jwks_file):
+    server = start_server(profile, args, jwks_file)
+    try:
+        started = time.monotonic()
+        latencies, failures = asyncio.run(load(args, token))
+        elapsed = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    if latencies:
+        median = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    else:
+        median = p99 = float('nan')
+    print(f'{profile:<10}{len(latencies) / elapsed:>12.1f}'
+          f'{median:>12.1f}{p99:>12.1f}{len(failures):>10}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--duration', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--path', default='/tasks')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES),
+                        choices=list(PROFILES))
+    args = parser.parse_args(argv)
+
+    print(f'Seeding {args.tasks} tasks...')
+    seed(args.tasks)
+    keys = tempfile.mkdtemp()
+    jwks_file = os.path.join(keys, 'jwks.json')
+    private_pem = load_or_create_keys(os.path.join(keys, 'key.pem'),
+                                      jwks_file)
+    token = mint_token(private_pem, 'parent')
+
+    print(f'{args.clients} clients, {args.workers} workers, '
+          f'{args.duration}s per profile')
+    print(f'{"profile":<10}{"req/s":>12}{"median ms":>12}'
+          f'{"p99 ms":>12}{"failed":>10}')
+    for profile in args.profiles:
+        missing = [name for name in PROFILES[profile]
+                   if importlib.util.find_spec(name) is None]
+        if missing:
+            print(f'{profile:<10}skipped, missing {", ".join(missing)}')
+            continue
+        run_profile(profile, args, token, jwks_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from models import on_tables_committed, get_table_versions
+
+'''
+Response cache for the read endpoints (/tasks, /people and
+/people/<id>/tasks).
+
+Entries hold the serialized JSON body together with its ETag and
+Last-Modified, so a hit skips the listing query and the encoding.
+Every key embeds the generation of the tables the response was built
+from. Committing an insert, update or delete on one of those tables
+changes its generation, so only the affected responses stop being
+found; the old entries age out of the LRU or expire.
+
+The generations have to be the same in every worker:
+    memory backend: the table versions in table_versions, read with
+                    one primary-key lookup per request
+    redis backend: counters kept next to the entries and bumped
+                   after every commit, so a hit needs no query
+
+Configuration:
+    RESPONSE_CACHE: 'memory' (default), 'redis' or 'off'
+    RESPONSE_CACHE_URL: redis URL used by the 'redis' backend
+    RESPONSE_CACHE_SIZE: entries kept by the 'memory' backend
+    RESPONSE_CACHE_TTL: seconds an entry is kept
+'''
+
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL',
+                                    'redis://localhost:6379/0')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 10))
+
+CachedResponse = namedtuple('CachedResponse',
+                            ['etag', 'last_modified', 'body'])
+
+
+'''
+MemoryBackend
+    In-process LRU. Each worker has its own entries, looked up with
+    the table versions from the database (shared = False), so a
+    write made by any worker retires them.
+'''
+
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+'''
+RedisBackend(client)
+    Shared cache for all workers, generation counters included
+    (shared = True). client is a redis.Redis created with
+    decode_responses=True, or any object with the same get, mget,
+    set and incr methods (e.g. a stand-in in tests).
+'''
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, client, prefix='choremosta:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url=RESPONSE_CACHE_URL):
+        import redis
+        return cls(redis.Redis.from_url(url, decode_responses=True))
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def get_many(self, keys):
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def add(self, key, value):
+        self.client.set(self.prefix + key, value, nx=True)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+'''
+ResponseCache(backend, ttl)
+    Keys, hit/miss counters and invalidation on top of a backend.
+    Without a backend every lookup is a miss and nothing is stored.
+'''
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    '''
+    key(name, tables, *parts)
+        Builds the key of a response from its name, the parts that
+        select it (query string, user id) and the generation of each
+        table it depends on.
+    '''
+    def key(self, name, tables, *parts):
+        if self.backend is None:
+            return None
+        if self.backend.shared:
+            generations = self.shared_generations(tables)
+        else:
+            generations = get_table_versions(tables)
+        return ':'.join([name] + [str(part) for part in parts] +
+                        [str(generation) for generation in generations])
+
+    def shared_generations(self, tables):
+        gen_keys = ['gen:' + table for table in tables]
+        generations = self.backend.get_many(gen_keys)
+        for i, generation in enumerate(generations):
+            if generation is None:
+                # Start from a unique value: a shared backend may have
+                # evicted the counter while old entries are still alive
+                self.backend.add(gen_keys[i], time.time_ns())
+                generations[i] = self.backend.get(gen_keys[i])
+        return generations
+
+    def get(self, key):
+        value = None
+        if key is not None:
+            value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, last_modified, body = value.split('\n', 2)
+        return CachedResponse(
+            etag or None,
+            datetime.fromisoformat(last_modified) if last_modified
+            else None,
+            body)
+
+    def set(self, key, entry):
+        if key is None:
+            return
+        last_modified = entry.last_modified
+        value = '\n'.join([
+            entry.etag or '',
+            last_modified.isoformat() if last_modified else '',
+            entry.body])
+        self.backend.set(key, value, self.ttl)
+
+    # Only counters kept by a shared backend need bumping; the table
+    # versions were already bumped by the commit itself
+    def invalidate(self, tables):
+        if self.backend is None or not self.backend.shared:
+            return
+        for table in tables:
+            self.backend.incr('gen:' + table)
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__
+            if self.backend is not None else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hitRatio': self.hits / lookups if lookups else 0.0
+        }
+
+
+def make_backend(kind=RESPONSE_CACHE):
+    if kind == 'memory':
+        return MemoryBackend()
+    if kind == 'redis':
+        return RedisBackend.from_url()
+    return None
+
+
+response_cache = ResponseCache(make_backend())
+on_tables_committed(lambda tables: response_cache.invalidate(tables))
+
+
+'''
+use_backend(backend) method
+    Swaps the backend of response_cache (e.g. for a stand-in in
+    tests) and resets its counters.
+'''
+
+
+def use_backend(backend):
+    response_cache.backend = backend
+    response_cache.hits = 0
+    response_cache.misses = 0
+    response_cache.invalidations = 0
@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+from sqlalchemy import exc, event
+from sqlalchemy.pool import QueuePool
+
+'''
+Connection pool profile and metrics.
+
+pool_options(config, database_path) builds the engine options for
+setup_db from the app config, falling back to the environment:
+    DB_POOL_SIZE: connections kept open per worker (default 5)
+    DB_MAX_OVERFLOW: extra connections allowed under load (default 10)
+    DB_POOL_TIMEOUT: seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE: seconds after which a connection is replaced
+                     (default 1800, -1 disables)
+    DB_POOL_PRE_PING: test connections on checkout, so connections
+                      broken by a failover are replaced (default true)
+    DB_STATEMENT_TIMEOUT: PostgreSQL statement_timeout in milliseconds
+                          (default 0, no timeout)
+Every worker has its own pool: workers * (DB_POOL_SIZE +
+DB_MAX_OVERFLOW) has to stay below the server's max_connections.
+'''
+
+
+def parse_flag(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+POOL_SETTINGS = (
+    ('DB_POOL_SIZE', 'pool_size', int, 5),
+    ('DB_MAX_OVERFLOW', 'max_overflow', int, 10),
+    ('DB_POOL_TIMEOUT', 'pool_timeout', int, 30),
+    ('DB_POOL_RECYCLE', 'pool_recycle', int, 1800),
+    ('DB_POOL_PRE_PING', 'pool_pre_ping', parse_flag, True),
+)
+
+
+def get_setting(config, name, parse, default):
+    value = config.get(name, os.environ.get(name))
+    if value is None or value == '':
+        return default
+    return parse(value)
+
+
+def pool_options(config, database_path):
+    options = {}
+    sqlite = database_path.startswith('sqlite')
+    for name, option, parse, default in POOL_SETTINGS:
+        # SQLite uses Flask-SQLAlchemy's own pools, which take no size
+        if sqlite and option != 'pool_pre_ping':
+            continue
+        options[option] = get_setting(config, name, parse, default)
+    if not sqlite:
+        options['poolclass'] = MeteredQueuePool
+    statement_timeout = get_setting(config, 'DB_STATEMENT_TIMEOUT', int, 0)
+    if statement_timeout and database_path.startswith('postgres'):
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+'''
+MeteredQueuePool
+    QueuePool that counts checkouts and the time they took
+    (waiting for a free connection, connecting, pre-ping), timeouts,
+    overflow connections and connections invalidated (e.g. by a
+    failed pre-ping).
+'''
+
+
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.checkout_max = 0.0
+        self.timeouts = 0
+        self.overflows = 0
+        self.invalidations = 0
+        event.listen(self, 'invalidate', self._on_invalidate)
+
+    # engine.dispose() replaces the pool with recreate(), whose
+    # QueuePool version drops pre_ping and copies every listener of
+    # this pool. The new pool registers its own _on_invalidate, so
+    # this pool's is removed first rather than copied.
+    def recreate(self):
+        if event.contains(self, 'invalidate', self._on_invalidate):
+            event.remove(self, 'invalidate', self._on_invalidate)
+        pool = super().recreate()
+        pool._pre_ping = self._pre_ping
+        return pool
+
+    # The engine checks out through either method depending on the
+    # call path
+    def connect(self):
+        return self._timed_checkout(super().connect)
+
+    def unique_connection(self):
+        return self._timed_checkout(super().unique_connection)
+
+    def _timed_checkout(self, checkout):
+        started = time.perf_counter()
+        try:
+            return checkout()
+        except exc.TimeoutError:
+            with self.metrics_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.metrics_lock:
+                self.checkouts += 1
+                self.checkout_time += elapsed
+                self.checkout_max = max(self.checkout_max, elapsed)
+
+    def _inc_overflow(self):
+        created = super()._inc_overflow()
+        if created and self._overflow > 0:
+            with self.metrics_lock:
+                self.overflows += 1
+        return created
+
+    def _on_invalidate(self, dbapi_connection, connection_record,
+                       exception):
+        with self.metrics_lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self.metrics_lock:
+            return {
+                'size': self.size(),
+                'checkedOut': self.checkedout(),
+                'idle': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'checkoutTotalMs': self.checkout_time * 1000,
+                'checkoutMaxMs': self.checkout_max * 1000,
+                'timeouts': self.timeouts,
+                'overflowConnections': self.overflows,
+                'invalidations': self.invalidations
+            }
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    if isinstance(pool, MeteredQueuePool):
+        stats = pool.stats()
+    else:
+        stats = {}
+    stats['pool'] = type(pool).__name__
+    stats['pid'] = os.getpid()
+    return stats
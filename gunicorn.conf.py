@@ -0,0 +1,46 @@
+import os
+
+'''
+gunicorn settings, read from the working directory by default.
+
+The app is loaded once in the master and the workers are forked from
+it (preload_app), sharing its memory. The master's pooled database
+connections are closed before forking and every worker disposes its
+copy of the engine after the fork, so no connection is shared between
+processes.
+
+GUNICORN_WORKER_CLASS selects the worker profile:
+    sync (default): one request at a time per worker
+    gevent: up to GUNICORN_WORKER_CONNECTIONS concurrent requests per
+            worker, each in a greenlet. Needs gevent and psycogreen.
+'''
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+if worker_class == 'gevent':
+    # Patch before preload_app imports the app in the master: sockets,
+    # ssl and threads, so the JWKS fetch (urlopen) and its background
+    # refresh yield to other requests, and psycopg2, whose calls would
+    # otherwise block the whole worker while waiting on PostgreSQL.
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+def pre_fork(server, worker):
+    from models import dispose_engine
+    dispose_engine()
+
+
+def post_fork(server, worker):
+    from models import dispose_engine
+    from auth.auth import jwks_cache
+    dispose_engine()
+    # Fetch the signing keys now, in the background, rather than in
+    # the worker's first authenticated request
+    jwks_cache.prefetch()
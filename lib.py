@@ -1,9 +1,60 @@
 # ----------------------------------------------------------------------------#
 # Imports
 # ----------------------------------------------------------------------------#
+import io
+import csv
+import json
+import base64
+import hashlib
 import dateutil.parser
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, abort, Response
+from sqlalchemy import and_, or_, case, text, select
+from sqlalchemy.exc import IntegrityError, DBAPIError
 from models import *
+from cache import response_cache, CachedResponse
+from serialization import jsonify, dumps, response_body
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip by the server-side cursor when streaming
+STREAM_BATCH_SIZE = 1000
+# Largest number of items accepted by a bulk endpoint
+MAX_BULK_SIZE = 1000
+# Rows written per transaction by the people import
+IMPORT_BATCH_SIZE = 1000
+# Rejected line numbers reported back by the people import
+MAX_REPORTED_REJECTS = 100
+# Largest number of assignments accepted by /people/assign_tasks
+MAX_ASSIGNMENTS = 10000
+# Rows per INSERT statement, keeps bind parameters under driver limits
+INSERT_CHUNK_SIZE = 1000
+# ----------------------------------------------------------------------------#
+# Column projections.
+# The list helpers select only the columns they return and read them
+# as plain rows: no ORM instances, no identity map. rows_to_dicts()
+# turns the rows into the same dicts as the models' format().
+# ----------------------------------------------------------------------------#
+TASK_FIELDS = (('id', Task.id), ('description', Task.description))
+PERSON_FIELDS = (('id', Person.id), ('name', Person.name))
+USER_TASK_FIELDS = (('personId', PersonTask.personid),
+                    ('taskId', PersonTask.taskid),
+                    ('startDate', PersonTask.startdate),
+                    ('dueBy', PersonTask.dueby),
+                    ('status', PersonTask.status),
+                    ('description', Task.description))
+
+
+def select_fields(fields):
+    return select([column for _, column in fields])
+
+
+def rows_to_dicts(fields, rows):
+    keys = [key for key, _ in fields]
+    return [dict(zip(keys, row)) for row in rows]
+
+
 # ----------------------------------------------------------------------------#
 # Supporting functions.
 # ----------------------------------------------------------------------------#
@@ -11,26 +62,714 @@ from models import *
 
 
 def get_tasks():
-    tasks = Task.query.order_by('id').all()
-    formmated_tasks = [task.format() for task in tasks]
-    return formmated_tasks
+    rows = db.session.execute(select_fields(TASK_FIELDS).order_by(Task.id))
+    return rows_to_dicts(TASK_FIELDS, rows)
+
+
+# Get one page of tasks, ordered by id
+def get_tasks_page(limit, after=None):
+    return get_page(TASK_FIELDS, limit, after)
+
+
+# Get all tasks for a selected user, with the task descriptions.
+# One query: person LEFT JOIN persontasks JOIN task, with the optional
+# status and due date filters in the join condition.
+# Returns None when the person does not exist.
+def get_user_tasks(user_id, status=None, due_after=None, due_before=None):
+    conditions = user_task_conditions(status, due_after, due_before)
+    joined = Person.__table__ \
+        .outerjoin(PersonTask.__table__, conditions) \
+        .outerjoin(Task.__table__, Task.id == PersonTask.taskid)
+    query = select([Person.id] +
+                   [column for _, column in USER_TASK_FIELDS]) \
+        .select_from(joined) \
+        .where(Person.id == user_id) \
+        .order_by(PersonTask.dueby)
+    rows = db.session.execute(query).fetchall()
+    if not rows:
+        return None
+
+    # Without assignments the person's only row has NULL persontasks
+    # columns
+    return rows_to_dicts(USER_TASK_FIELDS,
+                         (row[1:] for row in rows if row[1] is not None))
 
 
-# Get all tasks for a selected user
-def get_user_tasks(user_id):
-    person = Person.query.filter(Person.id == user_id).one_or_none()
-    if person is None:
-        abort(404)
+# Join condition from person to the persontasks to list
+def user_task_conditions(status=None, due_after=None, due_before=None):
+    conditions = [PersonTask.personid == Person.id]
+    if status is not None:
+        conditions.append(PersonTask.status == status)
+    if due_after is not None:
+        conditions.append(PersonTask.dueby >= due_after)
+    if due_before is not None:
+        conditions.append(PersonTask.dueby <= due_before)
+    return and_(*conditions)
 
-    formmated_tasks = [task.format() for task in person.tasks]
-    return formmated_tasks
+
+# Fingerprint of what get_user_tasks would return: the number of
+# matching assignments, the sum of their row versions (every UPDATE
+# adds one, even when it commits after a later transaction) and
+# their latest change, read with one aggregate query over the
+# (personid, ...) indexes.
+# Returns None when the person does not exist.
+def get_user_tasks_etag(user_id, status=None, due_after=None,
+                        due_before=None):
+    conditions = user_task_conditions(status, due_after, due_before)
+    row = db.session.query(db.func.count(PersonTask.personid),
+                           db.func.sum(PersonTask.version),
+                           db.func.max(PersonTask.updated)) \
+        .select_from(Person) \
+        .outerjoin(PersonTask, conditions) \
+        .filter(Person.id == user_id) \
+        .group_by(Person.id).one_or_none()
+    if row is None:
+        return None
+    count, versions, updated = row
+    return make_etag('user_tasks', user_id, status, due_after, due_before,
+                     count, versions, updated)
+
+
+def make_etag(*parts):
+    raw = '|'.join(str(part) for part in parts).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+# ETag and Last-Modified of a collection endpoint (GET /tasks,
+# GET /people): the table's change version plus the query string.
+# One primary key lookup on table_versions.
+def get_collection_etag(table):
+    row = TableVersion.query.get(table)
+    if row is None:
+        return None, None
+    etag = make_etag(table, row.version,
+                     request.query_string.decode('utf-8'))
+    return etag, row.updated
+
+
+# 304 Not Modified for a GET whose If-None-Match matches etag or,
+# without If-None-Match, whose If-Modified-Since is not older than
+# last_modified
+def not_modified(etag, last_modified=None):
+    if request.method != 'GET' or etag is None:
+        return None
+    if request.if_none_match:
+        if not request.if_none_match.contains(etag):
+            return None
+    elif last_modified is not None and request.if_modified_since:
+        if last_modified.replace(microsecond=0) > \
+                request.if_modified_since.replace(tzinfo=None):
+            return None
+    else:
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+# Adds ETag, Last-Modified and Cache-Control to a collection response
+def set_validators(response, etag, last_modified):
+    if etag is not None:
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# Serve a GET from the response cache. On a miss validators()
+# returns (etag, last_modified) and build() the JSON payload; both
+# run after the key is taken so a concurrent write can only leave
+# behind an entry nobody looks up anymore. A conditional GET that
+# matches the validators is answered before build() runs.
+def cached_json_response(name, tables, validators, build, *parts):
+    query = request.query_string.decode('utf-8')
+    try:
+        key = response_cache.key(name, tables, *parts, query)
+        entry = response_cache.get(key)
+    except Exception as e:
+        # An unreachable shared backend must not take reads down
+        print(e)
+        key, entry = None, None
+    if entry is None:
+        etag, last_modified = validators()
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
+        body = response_body(build()).decode('utf-8')
+        entry = CachedResponse(etag, last_modified, body)
+        try:
+            response_cache.set(key, entry)
+        except Exception as e:
+            print(e)
+    response = not_modified(entry.etag, entry.last_modified)
+    if response is None:
+        response = Response(entry.body, mimetype='application/json')
+        set_validators(response, entry.etag, entry.last_modified)
+    return response
+
+
+# Read the user task filters (status, dueAfter, dueBefore)
+# from the query string
+def get_user_task_filters():
+    filters = {'status': request.args.get('status')}
+    for arg, key in (('dueAfter', 'due_after'), ('dueBefore', 'due_before')):
+        value = request.args.get(arg)
+        try:
+            filters[key] = parse_datetime(value) if value else None
+        except ValueError:
+            abort(400)
+    return filters
 
 
 # Get all people
 def get_people():
-    people = Person.query.order_by('id').all()
-    formmated_people = [person.format() for person in people]
-    return formmated_people
+    rows = db.session.execute(select_fields(PERSON_FIELDS)
+                              .order_by(Person.id))
+    return rows_to_dicts(PERSON_FIELDS, rows)
+
+
+# Get one page of people, ordered by id
+def get_people_page(limit, after=None):
+    return get_page(PERSON_FIELDS, limit, after)
+
+
+# ----------------------------------------------------------------------------#
+# Keyset pagination.
+# Pages are read with "WHERE id > <last id> ORDER BY id LIMIT n"
+# so every page costs the same as the first one.
+# ----------------------------------------------------------------------------#
+# fields: column projection whose first column is the id
+def get_page(fields, limit, after=None):
+    id_column = fields[0][1]
+    query = select_fields(fields).order_by(id_column)
+    if after is not None:
+        query = query.where(id_column > decode_cursor(after))
+    # Read one extra row to know whether there is a next page
+    rows = db.session.execute(query.limit(limit + 1)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0])
+    return rows_to_dicts(fields, rows), next_cursor
+
+
+def encode_cursor(last_id):
+    raw = json.dumps({'id': last_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        return int(json.loads(raw)['id'])
+    except Exception:
+        abort(400)
+
+
+# Read limit/after from the query string.
+# Returns None when the client did not ask for a page.
+def get_page_args():
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    if limit is None and after is None:
+        return None
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        abort(400)
+    return limit, after
+
+
+# ----------------------------------------------------------------------------#
+# Streaming listings.
+# Rows are read through a server-side cursor (stream_results) and written
+# out as they arrive, so memory stays flat whatever the table size.
+# ----------------------------------------------------------------------------#
+def stream_tasks():
+    return stream_listing(TASK_FIELDS, 'tasks', 'totalTasks')
+
+
+def stream_people():
+    return stream_listing(PERSON_FIELDS, 'people', 'totalPeople')
+
+
+# Each batch of rows is encoded as one JSON array whose brackets are
+# dropped, so the batches join into a single list.
+def stream_listing(fields, key, total_key):
+    query = select_fields(fields).order_by(fields[0][1]) \
+        .execution_options(stream_results=True)
+    result = db.session.execute(query)
+    yield b'{"success": true, "%s": [' % key.encode('utf-8')
+    count = 0
+    separator = b''
+    while True:
+        rows = result.fetchmany(STREAM_BATCH_SIZE)
+        if not rows:
+            break
+        yield separator + dumps(rows_to_dicts(fields, rows))[1:-1]
+        separator = b','
+        count += len(rows)
+    yield b'], "%s": %d}' % (total_key.encode('utf-8'), count)
+
+
+# Ask for a streamed listing with ?stream=true
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true')
+
+
+# ----------------------------------------------------------------------------#
+# Request bodies.
+# @json_body(field=parser, ...) reads the JSON body once, runs each
+# parser on its field and passes the results to the view as keyword
+# arguments. A body that is not an object, or a field its parser
+# rejects, is a 400 before the view (and any database access) runs.
+# ----------------------------------------------------------------------------#
+def json_body(**schema):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict):
+                abort(400)
+            for field, parse in schema.items():
+                try:
+                    kwargs[field] = parse(body.get(field))
+                except (TypeError, ValueError, OverflowError):
+                    abort(400)
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def integer(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError('not an integer')
+    return value
+
+
+def string(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError('not a non-empty string')
+    return value
+
+
+# ----------------------------------------------------------------------------#
+# Prefer: return=minimal / return=representation (RFC 7240).
+# Lets write endpoints answer with only the affected resource
+# (or nothing) instead of the full table.
+# ----------------------------------------------------------------------------#
+def get_return_preference():
+    prefer = request.headers.get('Prefer', '')
+    for preference in prefer.replace(';', ',').split(','):
+        preference = preference.strip().lower().replace(' ', '')
+        if preference in ('return=minimal', 'return=representation'):
+            return preference.split('=')[1]
+    return None
+
+
+def resource_response(preference, key, resource, status=200):
+    if preference == 'minimal':
+        response = Response(status=204)
+    else:
+        response = jsonify({'success': True, key: resource})
+        response.status_code = status
+    response.headers['Preference-Applied'] = 'return=' + preference
+    return response
+
+
+# ----------------------------------------------------------------------------#
+# Bulk writes.
+# ----------------------------------------------------------------------------#
+# Create many tasks: one query to find the existing descriptions,
+# one multi-row INSERT for the new ones and a single commit.
+# Returns a created/duplicate status per submitted description.
+def bulk_add_tasks(descriptions):
+    if (not isinstance(descriptions, list) or
+            len(descriptions) > MAX_BULK_SIZE or
+            not all(isinstance(d, str) and d for d in descriptions)):
+        abort(400)
+    unique = list(dict.fromkeys(descriptions))
+    existing = set()
+    if unique:
+        existing = {row.description for row in
+                    Task.query.with_entities(Task.description).filter(
+                        Task.description.in_(unique))}
+    new = [d for d in unique if d not in existing]
+    if new:
+        db.session.execute(Task.__table__.insert().values(
+            [{'description': d} for d in new]))
+        mark_changed(db.session, 'task')
+        db.session.commit()
+
+    created = set(new)
+    results = []
+    for description in descriptions:
+        if description in created:
+            results.append({'description': description,
+                            'status': 'created'})
+            # Later repeats of the same description are duplicates
+            created.discard(description)
+        else:
+            results.append({'description': description,
+                            'status': 'duplicate'})
+    return results
+
+
+# Import people from a CSV (header: name,ssn) or NDJSON stream.
+# The body is read line by line and written in batches of batch_size,
+# each in its own transaction, so memory stays bounded by one batch.
+# Returns the inserted / duplicate / rejected counts.
+def import_people_stream(stream, content_type,
+                         batch_size=IMPORT_BATCH_SIZE):
+    summary = {'inserted': 0, 'duplicates': 0, 'rejected': 0,
+               'rejectedLines': []}
+    batch = []
+    for line_no, row in read_people_rows(stream, content_type):
+        if row is None:
+            summary['rejected'] += 1
+            if len(summary['rejectedLines']) < MAX_REPORTED_REJECTS:
+                summary['rejectedLines'].append(line_no)
+            continue
+        batch.append(row)
+        if len(batch) == batch_size:
+            import_people_batch(batch, summary)
+            batch = []
+    if batch:
+        import_people_batch(batch, summary)
+    return summary
+
+
+# A body that is not UTF-8 is a 400 (batches before the undecodable
+# bytes are already written). A CSV row the csv module cannot parse,
+# e.g. a field over csv.field_size_limit(), is rejected.
+def read_people_rows(stream, content_type):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    try:
+        if content_type == 'text/csv':
+            yield from read_csv_rows(text)
+        else:
+            yield from read_ndjson_rows(text)
+    except UnicodeDecodeError:
+        abort(400)
+
+
+def read_csv_rows(text):
+    reader = csv.DictReader(text)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            row = None
+        # DictReader.line_num is only updated by rows that parse
+        yield reader.reader.line_num, clean_person_row(row)
+
+
+def read_ndjson_rows(text):
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_no, clean_person_row(row)
+
+
+def clean_person_row(row):
+    if not isinstance(row, dict):
+        return None
+    name = row.get('name')
+    ssn = row.get('ssn')
+    if not isinstance(name, str) or not isinstance(ssn, str):
+        return None
+    name = name.strip()
+    ssn = ssn.strip()
+    # PostgreSQL text cannot hold NUL
+    if not name or not ssn or '\x00' in name or '\x00' in ssn:
+        return None
+    return name, ssn
+
+
+def import_people_batch(batch, summary):
+    try:
+        inserted = insert_new_people(batch)
+    except IntegrityError:
+        # Someone else inserted one of these people meanwhile: retry once
+        db.session.rollback()
+        inserted = insert_new_people(batch)
+    summary['inserted'] += inserted
+    summary['duplicates'] += len(batch) - inserted
+
+
+def insert_new_people(batch):
+    unique = list(dict.fromkeys(batch))
+    names = {name for name, _ in unique}
+    existing = set(Person.query.with_entities(Person.name, Person.ssn)
+                   .filter(Person.name.in_(names)))
+    new = [person for person in unique if person not in existing]
+    if new:
+        if supports_copy():
+            copy_people(new)
+        else:
+            rows = [{'name': name, 'ssn': ssn} for name, ssn in new]
+            for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                db.session.execute(Person.__table__.insert().values(
+                    rows[start:start + INSERT_CHUNK_SIZE]))
+        mark_changed(db.session, 'person')
+    db.session.commit()
+    return len(new)
+
+
+def supports_copy():
+    return (db.engine.dialect.name == 'postgresql' and
+            db.engine.dialect.driver == 'psycopg2')
+
+
+COPY_PEOPLE = 'COPY person (name, ssn) FROM STDIN WITH (FORMAT csv)'
+
+
+# COPY ... FROM STDIN through the session's own connection,
+# so it is part of the batch transaction. The raw cursor raises
+# driver exceptions: they are wrapped in the SQLAlchemy types
+# (IntegrityError for a duplicate), as session.execute() would.
+def copy_people(people):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(people)
+    buffer.seek(0)
+    dbapi = db.engine.dialect.dbapi
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(COPY_PEOPLE, buffer)
+    except dbapi.Error as e:
+        raise DBAPIError.instance(COPY_PEOPLE, None, e, dbapi.Error,
+                                  dialect=db.engine.dialect) from e
+    finally:
+        cursor.close()
+
+
+# Assign many tasks in one transaction.
+# body is either {'assignments': [{personId, taskId, startDate,
+# dueBy, status}, ...]} or a cross product {'personIds': [...],
+# 'taskIds': [...], startDate, dueBy, status}.
+# Person and task ids are checked with one query per table and
+# existing (personid, taskid, startdate) keys with one more query.
+# Returns a result per assignment: created, conflict or invalid.
+def bulk_assign_tasks(body):
+    items = expand_assignments(body)
+    results = []
+    rows = []
+    for item in items:
+        row = parse_assignment(item)
+        results.append({
+            'personId': item.get('personId'),
+            'taskId': item.get('taskId'),
+            'startDate': item.get('startDate'),
+            'result': 'invalid' if row is None else None
+        })
+        rows.append(row)
+
+    try:
+        created = insert_assignments(rows, results)
+    except IntegrityError:
+        # A concurrent request took one of the keys: retry once
+        db.session.rollback()
+        created = insert_assignments(rows, results)
+    return results, created
+
+
+def expand_assignments(body):
+    if not isinstance(body, dict):
+        abort(400)
+    if 'assignments' in body:
+        items = body['assignments']
+        if (not isinstance(items, list) or
+                not all(isinstance(item, dict) for item in items)):
+            abort(400)
+    else:
+        person_ids = body.get('personIds')
+        task_ids = body.get('taskIds')
+        if not isinstance(person_ids, list) or \
+                not isinstance(task_ids, list):
+            abort(400)
+        if len(person_ids) * len(task_ids) > MAX_ASSIGNMENTS:
+            abort(400)
+        common = {key: body.get(key)
+                  for key in ('startDate', 'dueBy', 'status')}
+        items = [dict(common, personId=person_id, taskId=task_id)
+                 for person_id in person_ids for task_id in task_ids]
+    if len(items) > MAX_ASSIGNMENTS:
+        abort(400)
+    return items
+
+
+# Fields are checked with the json_body parsers, so a bulk item is
+# valid exactly when the single-item endpoint would accept it.
+def parse_assignment(item):
+    status = item.get('status')
+    try:
+        return (integer(item.get('personId')),
+                integer(item.get('taskId')),
+                parse_datetime(item.get('startDate')),
+                parse_datetime(item.get('dueBy')),
+                'Not_Started' if status is None else string(status))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+# ISO 8601 string (or datetime) to a naive UTC datetime
+def parse_datetime(value):
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str):
+        try:
+            parsed = dateutil.parser.isoparse(value)
+        except (ValueError, OverflowError):
+            parsed = dateutil.parser.parse(value)
+    else:
+        raise ValueError('not a date')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def insert_assignments(rows, results):
+    valid = [row for row in rows if row is not None]
+    person_ids = {row[0] for row in valid}
+    task_ids = {row[1] for row in valid}
+    known_people = set()
+    known_tasks = set()
+    taken = set()
+    if valid:
+        known_people = {id_ for id_, in db.session.query(Person.id)
+                        .filter(Person.id.in_(person_ids))}
+        known_tasks = {id_ for id_, in db.session.query(Task.id)
+                       .filter(Task.id.in_(task_ids))}
+        taken = set(db.session.query(PersonTask.personid,
+                                     PersonTask.taskid,
+                                     PersonTask.startdate)
+                    .filter(PersonTask.personid.in_(person_ids),
+                            PersonTask.taskid.in_(task_ids)))
+
+    new = []
+    for row, result in zip(rows, results):
+        if row is None:
+            continue
+        if row[0] not in known_people or row[1] not in known_tasks:
+            result['result'] = 'invalid'
+        elif row[:3] in taken:
+            result['result'] = 'conflict'
+        else:
+            result['result'] = 'created'
+            taken.add(row[:3])
+            new.append({'personid': row[0], 'taskid': row[1],
+                        'startdate': row[2], 'dueby': row[3],
+                        'status': row[4]})
+    for start in range(0, len(new), INSERT_CHUNK_SIZE):
+        db.session.execute(PersonTask.__table__.insert().values(
+            new[start:start + INSERT_CHUNK_SIZE]))
+    if new:
+        mark_changed(db.session, 'persontasks')
+    db.session.commit()
+    return len(new)
+
+
+# Update the status of many assignments.
+# updates is a list of {personId, taskId, startDate, status}.
+# All keys are applied by one UPDATE per INSERT_CHUNK_SIZE keys in a
+# single transaction: UPDATE ... FROM (VALUES ...) RETURNING on
+# PostgreSQL, a CASE expression elsewhere.
+# Returns a result per key: updated, not_found or invalid.
+def bulk_update_task_statuses(updates):
+    if not isinstance(updates, list) or len(updates) > MAX_ASSIGNMENTS:
+        abort(400)
+    parsed = [parse_status_update(item) for item in updates]
+    # The last status given for a key wins
+    statuses = {key[:3]: key[3] for key in parsed if key is not None}
+
+    updated = set()
+    items = list(statuses.items())
+    for start in range(0, len(items), INSERT_CHUNK_SIZE):
+        chunk = items[start:start + INSERT_CHUNK_SIZE]
+        if db.engine.dialect.name == 'postgresql':
+            updated |= update_statuses_from_values(chunk)
+        else:
+            updated |= update_statuses_with_case(chunk)
+    if updated:
+        mark_changed(db.session, 'persontasks')
+    db.session.commit()
+
+    results = []
+    for item, key in zip(updates, parsed):
+        if key is None:
+            results.append({'result': 'invalid'})
+            continue
+        results.append({
+            'personId': key[0],
+            'taskId': key[1],
+            'startDate': item['startDate'],
+            'result': 'updated' if key[:3] in updated else 'not_found'
+        })
+    return results, len(updated)
+
+
+def parse_status_update(item):
+    if not isinstance(item, dict):
+        return None
+    try:
+        return (integer(item.get('personId')),
+                integer(item.get('taskId')),
+                parse_datetime(item.get('startDate')),
+                string(item.get('status')))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+# No SQLAlchemy construct for a VALUES list here, so the statement is
+# spelled out; every value is still a bound parameter.
+def update_statuses_from_values(chunk):
+    rows = []
+    params = {}
+    for i, ((person_id, task_id, startdate), status) in enumerate(chunk):
+        rows.append(f'(:p{i}, :t{i}, :d{i}, :s{i})')
+        params.update({f'p{i}': person_id, f't{i}': task_id,
+                       f'd{i}': startdate, f's{i}': status})
+    statement = text(
+        'UPDATE persontasks SET status = v.status, updated = now(), '
+        'version = persontasks.version + 1 '
+        'FROM (VALUES ' + ', '.join(rows) + ') '
+        'AS v (personid, taskid, startdate, status) '
+        'WHERE persontasks.personid = v.personid '
+        'AND persontasks.taskid = v.taskid '
+        'AND persontasks.startdate = v.startdate '
+        'RETURNING persontasks.personid, persontasks.taskid, '
+        'persontasks.startdate')
+    return {tuple(row) for row in db.session.execute(statement, params)}
+
+
+def update_statuses_with_case(chunk):
+    table = PersonTask.__table__
+    conditions = [and_(table.c.personid == person_id,
+                       table.c.taskid == task_id,
+                       table.c.startdate == startdate)
+                  for (person_id, task_id, startdate), _ in chunk]
+    found = {tuple(row) for row in db.session.execute(
+        table.select().with_only_columns(
+            [table.c.personid, table.c.taskid, table.c.startdate])
+        .where(or_(*conditions)))}
+    db.session.execute(table.update().where(or_(*conditions)).values(
+        status=case([(condition, status) for condition, (_, status)
+                     in zip(conditions, chunk)],
+                    else_=table.c.status)))
+    return found
 
 
 # Find person
@@ -1,14 +1,28 @@
-from flask_script import Manager
+from flask_script import Manager, Command
 from flask_migrate import Migrate, MigrateCommand
 
-from app import app
-from models import db
+from app import create_app
+from models import db, create_schema
 
+# Schema commands run against databases that are not (yet) at the
+# expected revision
+app = create_app({'SCHEMA_CHECK': 'off'})
 migrate = Migrate(app, db)
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
 
+class CreateDb(Command):
+    """Create all tables on an empty database and stamp it as
+    migrated to the latest revision."""
+
+    def run(self):
+        create_schema()
+
+
+manager.add_command('create_db', CreateDb())
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,28 @@
+"""unique indexes for person and task lookups
+
+Revision ID: 3f1c2a7b9e40
+Revises: d81b809d39d5
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7b9e40'
+down_revision = 'd81b809d39d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # uq_person backs personLookup (name, ssn),
+    # uq_task backs taskLookup and the duplicate check in add_task
+    op.create_unique_constraint('uq_person', 'person', ['name', 'ssn'])
+    op.create_unique_constraint('uq_task', 'task', ['description'])
+
+
+def downgrade():
+    op.drop_constraint('uq_task', 'task', type_='unique')
+    op.drop_constraint('uq_person', 'person', type_='unique')
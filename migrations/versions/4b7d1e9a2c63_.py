@@ -0,0 +1,26 @@
+"""persontasks row version
+
+Revision ID: 4b7d1e9a2c63
+Revises: f1a9c3d57b62
+Create Date: 2026-10-18 17:41:06.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7d1e9a2c63'
+down_revision = 'f1a9c3d57b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('persontasks', sa.Column(
+        'version', sa.BigInteger(), nullable=False,
+        server_default='1'))
+
+
+def downgrade():
+    op.drop_column('persontasks', 'version')
@@ -0,0 +1,30 @@
+"""secondary indexes on persontasks
+
+Revision ID: 8a4d6e21c5f3
+Revises: 3f1c2a7b9e40
+Create Date: 2026-10-18 11:03:27.218764
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4d6e21c5f3'
+down_revision = '3f1c2a7b9e40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_persontasks_taskid', 'persontasks', ['taskid'])
+    op.create_index('ix_persontasks_personid_status', 'persontasks',
+                    ['personid', 'status'])
+    op.create_index('ix_persontasks_personid_dueby', 'persontasks',
+                    ['personid', 'dueby'])
+
+
+def downgrade():
+    op.drop_index('ix_persontasks_personid_dueby', table_name='persontasks')
+    op.drop_index('ix_persontasks_personid_status', table_name='persontasks')
+    op.drop_index('ix_persontasks_taskid', table_name='persontasks')
@@ -0,0 +1,38 @@
+"""on delete cascade for persontasks foreign keys
+
+Revision ID: c7e9f04b2d18
+Revises: 8a4d6e21c5f3
+Create Date: 2026-10-18 11:48:09.671205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e9f04b2d18'
+down_revision = '8a4d6e21c5f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint('fk_person_task_person', 'persontasks',
+                       type_='foreignkey')
+    op.drop_constraint('fk_person_task_task', 'persontasks',
+                       type_='foreignkey')
+    op.create_foreign_key('fk_person_task_person', 'persontasks', 'person',
+                          ['personid'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('fk_person_task_task', 'persontasks', 'task',
+                          ['taskid'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_constraint('fk_person_task_task', 'persontasks',
+                       type_='foreignkey')
+    op.drop_constraint('fk_person_task_person', 'persontasks',
+                       type_='foreignkey')
+    op.create_foreign_key('fk_person_task_task', 'persontasks', 'task',
+                          ['taskid'], ['id'])
+    op.create_foreign_key('fk_person_task_person', 'persontasks', 'person',
+                          ['personid'], ['id'])
@@ -0,0 +1,26 @@
+"""persontasks updated timestamp
+
+Revision ID: e52b8f6a1d07
+Revises: c7e9f04b2d18
+Create Date: 2026-10-18 13:20:55.804312
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e52b8f6a1d07'
+down_revision = 'c7e9f04b2d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('persontasks', sa.Column(
+        'updated', sa.DateTime(), nullable=False,
+        server_default=sa.func.now()))
+
+
+def downgrade():
+    op.drop_column('persontasks', 'updated')
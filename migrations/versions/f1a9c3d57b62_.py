@@ -0,0 +1,34 @@
+"""table change versions for conditional GET
+
+Revision ID: f1a9c3d57b62
+Revises: e52b8f6a1d07
+Create Date: 2026-10-18 14:02:13.447920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a9c3d57b62'
+down_revision = 'e52b8f6a1d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.execute(table_versions.insert().values([
+        {'name': name, 'version': 0, 'updated': sa.func.now()}
+        for name in ('person', 'task', 'persontasks')
+    ]))
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -1,25 +1,115 @@
 import os
-from sqlalchemy import Column, String, create_engine, Integer
+from sqlalchemy import Column, String, create_engine, Integer, event, DDL
+from sqlalchemy import MetaData, Table, select, exc
 from flask_sqlalchemy import SQLAlchemy
+from itertools import chain
 import json
 from datetime import datetime
-
-database_path = os.environ['DATABASE_URL']
+from db_pool import pool_options
 
 db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service,
+    with the connection pool profile of the app config/environment.
+    database_path defaults to DATABASE_URL, read when the app is
+    created rather than when this module is imported.
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = os.environ['DATABASE_URL']
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Pool profile from DB_* config or environment (see db_pool.py);
+    # explicit SQLALCHEMY_ENGINE_OPTIONS win
+    engine_options = pool_options(app.config, database_path)
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
     db.app = app
     db.init_app(app)
+    # No DDL here: the schema is created by `python manage.py create_db`
+    # or migrated by `python manage.py db upgrade`
+    check_schema(app)
+
+
+# Revision of the newest migration in migrations/versions: the schema
+# this code expects. Update it together with every new migration.
+SCHEMA_REVISION = '4b7d1e9a2c63'
+
+alembic_version = Table('alembic_version', MetaData(),
+                        Column('version_num', String(32), primary_key=True))
+
+
+'''
+check_schema(app)
+    Compares the database's migration revision with SCHEMA_REVISION
+    (one query). SCHEMA_CHECK (app config or environment) chooses
+    what a mismatch does: 'warn' (default) prints it, 'strict'
+    raises RuntimeError so the worker does not boot, 'off' skips
+    the check.
+'''
+
+
+def check_schema(app):
+    mode = app.config.get('SCHEMA_CHECK',
+                          os.environ.get('SCHEMA_CHECK', 'warn'))
+    if mode == 'off':
+        return True
+    try:
+        with db.get_engine(app).connect() as conn:
+            revision = conn.execute(
+                select([alembic_version.c.version_num])).scalar()
+    except exc.DBAPIError:
+        # No alembic_version table: the schema was never created
+        revision = None
+    if revision == SCHEMA_REVISION:
+        return True
+    message = (f'Database schema is at revision {revision}, expected '
+               f'{SCHEMA_REVISION}. Run "python manage.py db upgrade" '
+               f'(or "python manage.py create_db" on an empty database).')
+    if mode == 'strict':
+        raise RuntimeError(message)
+    print(message)
+    return False
+
+
+'''
+dispose_engine()
+    Closes the pooled connections of the bound app's engine. Called
+    in the gunicorn master before forking and in each worker after
+    (see gunicorn.conf.py), so no worker reuses a connection
+    inherited from the master. The new pool keeps pre-ping, which
+    SQLAlchemy 1.3's Pool.recreate() leaves out.
+'''
+
+
+def dispose_engine():
+    if db.app is not None:
+        engine = db.get_engine(db.app)
+        pre_ping = engine.pool._pre_ping
+        engine.dispose()
+        engine.pool._pre_ping = pre_ping
+
+
+'''
+create_schema()
+    Creates all tables on an empty database and stamps it with
+    SCHEMA_REVISION, for new, test and scratch databases. Runs in
+    an application context.
+'''
+
+
+def create_schema():
     db.create_all()
+    engine = db.get_engine()
+    alembic_version.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(alembic_version.delete())
+        conn.execute(alembic_version.insert().values(
+            version_num=SCHEMA_REVISION))
 
 
 '''
@@ -35,9 +125,14 @@ class Person(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     ssn = db.Column(db.String, nullable=False)
-    db.UniqueConstraint('name', 'ssn', name='uq_person')
+    __table_args__ = (
+        db.UniqueConstraint('name', 'ssn', name='uq_person'),
+    )
 
-    tasks = db.relationship("PersonTask", cascade="all, delete")
+    # Assignments are removed by ON DELETE CASCADE in the database,
+    # passive_deletes keeps the ORM from loading them first
+    tasks = db.relationship("PersonTask", cascade="all, delete",
+                            passive_deletes=True)
 
     def __init__(self, name, ssn):
         self.name = name
@@ -74,9 +169,12 @@ class Task(db.Model):
 
     id = Column(Integer, primary_key=True)
     description = db.Column(db.String, nullable=False)
-    db.UniqueConstraint('description', name='uq_task')
+    __table_args__ = (
+        db.UniqueConstraint('description', name='uq_task'),
+    )
 
-    personTasks = db.relationship("PersonTask", cascade="all, delete")
+    personTasks = db.relationship("PersonTask", cascade="all, delete",
+                                  passive_deletes=True)
 
     def __init__(self, description):
         self.description = description
@@ -109,16 +207,34 @@ class PersonTask(db.Model):
     dt = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
 
     personid = db.Column(
-        db.Integer, db.ForeignKey('person.id', name='fk_person_task_person'),
+        db.Integer, db.ForeignKey('person.id', name='fk_person_task_person',
+                                  ondelete='CASCADE'),
         primary_key=True, nullable=False)
     taskid = db.Column(
-        db.Integer, db.ForeignKey('task.id', name='fk_person_task_task'),
+        db.Integer, db.ForeignKey('task.id', name='fk_person_task_task',
+                                  ondelete='CASCADE'),
         primary_key=True, nullable=False)
     startdate = db.Column(
         db.DateTime, nullable=False,
         primary_key=True, default=dt)
     dueby = db.Column(db.DateTime, nullable=False, default=dt)
     status = Column(String, nullable=False, default='Not_Started')
+    # Last change, set by the database. Part of the user tasks ETag.
+    updated = db.Column(db.DateTime, nullable=False,
+                        server_default=db.func.now(), onupdate=db.func.now())
+    # Bumped by every UPDATE of the row. Part of the user tasks ETag:
+    # unlike updated (the transaction's start time) its sum changes
+    # whatever order concurrent transactions commit in.
+    version = db.Column(db.BigInteger, nullable=False, server_default='1',
+                        onupdate=db.text('version + 1'))
+    # The primary key only serves lookups by personid.
+    # taskid backs the Task.personTasks cascade in delete_task,
+    # the other two back per-person status and due date filters.
+    __table_args__ = (
+        db.Index('ix_persontasks_taskid', 'taskid'),
+        db.Index('ix_persontasks_personid_status', 'personid', 'status'),
+        db.Index('ix_persontasks_personid_dueby', 'personid', 'dueby'),
+    )
 
     def __init__(self, personid, taskid, startdate, dueby, status):
         self.personid = personid
@@ -146,3 +262,118 @@ class PersonTask(db.Model):
           'dueBy': self.dueby,
           'status': self.status
           }
+
+
+'''
+TableVersion
+Change counter per table, bumped once per committed transaction
+that inserted, updated or deleted rows of the table.
+Used as the ETag / Last-Modified of the collection endpoints.
+'''
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def format(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'updated': self.updated}
+
+
+VERSIONED_TABLES = ('person', 'task', 'persontasks')
+
+event.listen(TableVersion.__table__, 'after_create', DDL(
+    "INSERT INTO table_versions (name, version, updated) VALUES " +
+    ", ".join(f"('{name}', 0, CURRENT_TIMESTAMP)"
+              for name in VERSIONED_TABLES)))
+
+
+'''
+get_table_versions(tables)
+    Current version of each of tables, in order (None for a table
+    without a row), read with one query on the primary key.
+'''
+
+
+def get_table_versions(tables):
+    table = TableVersion.__table__
+    versions = dict(db.session.execute(
+        select([table.c.name, table.c.version])
+        .where(table.c.name.in_(tables))).fetchall())
+    return [versions.get(name) for name in tables]
+
+
+'''
+mark_changed(session, *tables)
+    Records tables written outside the ORM (bulk INSERT/UPDATE
+    statements, COPY) so their version is bumped on commit.
+    ORM inserts, updates and deletes are picked up automatically.
+'''
+
+
+def mark_changed(session, *tables):
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+
+'''
+on_tables_committed(listener)
+    Registers listener(tables), called after every commit that
+    changed one of VERSIONED_TABLES with the set of changed tables.
+'''
+
+committed_listeners = []
+
+
+def on_tables_committed(listener):
+    committed_listeners.append(listener)
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changed_tables(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table in VERSIONED_TABLES:
+            mark_changed(session, table)
+    # Deleting a person or task cascades to persontasks in the database
+    if any(isinstance(obj, (Person, Task)) for obj in session.deleted):
+        mark_changed(session, 'persontasks')
+
+
+@event.listens_for(db.session, 'before_commit')
+def bump_table_versions(session):
+    # before_commit runs ahead of the final flush: flush now so its
+    # changes are collected too
+    session.flush()
+    tables = session.info.pop('changed_tables', None)
+    if not tables:
+        return
+    table = TableVersion.__table__
+    session.execute(table.update()
+                    .where(table.c.name.in_(sorted(tables)))
+                    .values(version=table.c.version + 1,
+                            updated=datetime.utcnow()))
+    session.info['committed_tables'] = tables
+
+
+@event.listens_for(db.session, 'after_commit')
+def notify_committed_tables(session):
+    tables = session.info.pop('committed_tables', None)
+    if not tables:
+        return
+    for listener in committed_listeners:
+        try:
+            listener(tables)
+        except Exception as e:
+            print(e)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def forget_changed_tables(session, previous_transaction):
+    session.info.pop('changed_tables', None)
+    session.info.pop('committed_tables', None)
@@ -0,0 +1,142 @@
+import os
+from datetime import datetime, timezone
+from flask import current_app, json as flask_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+'''
+JSON encoding of responses.
+
+jsonify() here replaces flask.jsonify and encodes through `provider`:
+    JSON_PROVIDER: 'auto' (default, orjson when installed), 'orjson'
+                   or 'stdlib' (Flask's encoder)
+    JSON_DATETIME_FORMAT: 'http' (default) keeps Flask's format for
+                   datetimes, e.g. 'Sun, 25 Oct 2020 00:00:00 GMT';
+                   'iso' writes ISO 8601, which orjson encodes natively
+Both providers return UTF-8 bytes and sort keys like Flask unless
+JSON_SORT_KEYS is off. Like flask.jsonify the output is compact,
+or indented by 2 under JSONIFY_PRETTYPRINT_REGULAR or debug.
+'''
+
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+JSON_DATETIME_FORMAT = os.environ.get('JSON_DATETIME_FORMAT', 'http')
+
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+# Same output as Flask's encoder (werkzeug.http_date of the time tuple),
+# without building the tuple and going through time.strftime
+def format_http_date(value):
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        WEEKDAYS[value.weekday()], value.day, MONTHS[value.month - 1],
+        value.year, value.hour, value.minute, value.second)
+
+
+class StdlibProvider:
+    name = 'stdlib'
+
+    def __init__(self, datetime_format=JSON_DATETIME_FORMAT):
+        self.datetime_format = datetime_format
+
+    # Separators and indent of flask.jsonify
+    def dumps(self, obj, sort_keys=True, pretty=False):
+        options = {'sort_keys': sort_keys, 'separators': (',', ':')}
+        if pretty:
+            options.update(indent=2, separators=(', ', ': '))
+        if self.datetime_format == 'iso':
+            options['cls'] = _IsoEncoder
+        return flask_json.dumps(obj, **options).encode('utf-8')
+
+
+# Naive datetimes are UTC, written with an explicit offset as orjson does
+class _IsoEncoder(flask_json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            if obj.tzinfo is None:
+                obj = obj.replace(tzinfo=timezone.utc)
+            return obj.isoformat()
+        return super().default(obj)
+
+
+class OrjsonProvider:
+    name = 'orjson'
+
+    def __init__(self, datetime_format=JSON_DATETIME_FORMAT):
+        self.datetime_format = datetime_format
+        self.options = orjson.OPT_NAIVE_UTC
+        if datetime_format != 'iso':
+            self.options |= orjson.OPT_PASSTHROUGH_DATETIME
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, datetime):
+            return format_http_date(obj)
+        if hasattr(obj, '__html__'):
+            return str(obj.__html__())
+        raise TypeError
+
+    def dumps(self, obj, sort_keys=True, pretty=False):
+        options = self.options
+        if sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=options)
+
+
+def make_provider(kind=JSON_PROVIDER):
+    if kind == 'orjson' or (kind == 'auto' and orjson is not None):
+        return OrjsonProvider()
+    return StdlibProvider()
+
+
+provider = make_provider()
+
+
+'''
+dumps(obj, pretty) method
+    Encodes obj with the current provider, honouring the
+    JSON_SORT_KEYS setting of the app when there is one.
+'''
+
+
+def dumps(obj, pretty=False):
+    sort_keys = True
+    if current_app:
+        sort_keys = current_app.config.get('JSON_SORT_KEYS', True)
+    return provider.dumps(obj, sort_keys, pretty)
+
+
+'''
+response_body(data) method
+    The body flask.jsonify would send for data: pretty printed
+    under JSONIFY_PRETTYPRINT_REGULAR or debug, newline-terminated.
+'''
+
+
+def response_body(data):
+    pretty = (current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or
+              current_app.debug)
+    return dumps(data, pretty) + b'\n'
+
+
+'''
+jsonify(*args, **kwargs) method
+    Same arguments and response as flask.jsonify.
+'''
+
+
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both '
+                        'args and kwargs')
+    data = args[0] if len(args) == 1 else (args or kwargs)
+    return current_app.response_class(
+        response_body(data),
+        mimetype=current_app.config['JSONIFY_MIMETYPE'])
@@ -1,8 +1,18 @@
 import os
+import time
 import unittest
+import threading
 import json
+from unittest import mock
 from flask_sqlalchemy import SQLAlchemy
 from app import *
+import auth.auth
+from auth.auth import JWKSCache, TokenCache, Principal, get_principal, \
+    jwks_cache, use_local_keys, check_permissions
+from flask import _request_ctx_stack, jsonify as flask_jsonify
+from auth.local import mint_token, generate_key_pair
+from cache import use_backend
+import serialization
 from datetime import datetime, timedelta
 
 db_name = 'choremosta_test'
@@ -10,10 +20,11 @@ db_name = 'choremosta_test'
 
 class ChoremostaTestCase(unittest.TestCase):
     """This class represents Choremosta test cases"""
+    schema_created = False
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = create_app({'METRICS_ENABLED': True})
         self.client = self.app.test_client
         self.database_name = "choremosta_test"
         self.database_url = "postgres:Aspen100@localhost:5432"
@@ -72,12 +83,11 @@ class ChoremostaTestCase(unittest.TestCase):
             'description': 'I am task for user list'
             }
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+        # create all tables, once per test run
+        if not ChoremostaTestCase.schema_created:
+            with self.app.app_context():
+                create_schema()
+            ChoremostaTestCase.schema_created = True
 
     def tearDown(self):
         """Executed after reach test"""
@@ -105,6 +115,48 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    # ------------------------------------------------------------------------------------#
+    # Bulk add: Success
+    # ------------------------------------------------------------------------------------#
+    def test_add_tasks_bulk(self):
+        """Test Bulk Add Tasks """
+        print('...............Parent:Test Bulk Add Tasks...............')
+        descriptions = ['I am bulk task 1', 'I am bulk task 2',
+                        'I am bulk task 1']
+        res = self.client().post(
+            '/tasks/bulk', json={'descriptions': descriptions},
+            headers=[
+                        ('Content-Type', 'application/json'),
+                        ('Authorization', f'Bearer {self.parent_user}')
+                    ])
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['tasks']), 3)
+        self.assertEqual(data['tasks'][2]['status'], 'duplicate')
+
+        # A body that is not an object
+        res = self.client().post(
+            '/tasks/bulk', json=[1],
+            headers=[
+                        ('Content-Type', 'application/json'),
+                        ('Authorization', f'Bearer {self.parent_user}')
+                    ])
+        self.assertEqual(res.status_code, 400)
+
+        # Cleanup
+        for description in descriptions[:2]:
+            res = self.client().post(
+                    '/tasks/find', json={'description': description})
+            task_id = json.loads(res.data).get('id', None)
+            res = self.client().delete(
+                    '/tasks/' + str(task_id) + '/delete',
+                    headers=[
+                                ('Content-Type', 'application/json'),
+                                ('Authorization', f'Bearer {self.parent_user}')
+                            ])
+            self.assertEqual(res.status_code, 200)
+
     # ------------------------------------------------------------------------------------#
     # Get: Success
     # ------------------------------------------------------------------------------------#
@@ -121,6 +173,135 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    # ------------------------------------------------------------------------------------#
+    # Get one page: Success
+    # ------------------------------------------------------------------------------------#
+    def test_list_tasks_page(self):
+        """Test List Tasks Page """
+        print('.............Parent:Test List Tasks Page............')
+        res = self.client().get(
+                '/tasks?limit=1',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['tasks']) <= 1)
+        self.assertIn('nextCursor', data)
+
+        res = self.client().get(
+                '/tasks?limit=0',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 400)
+
+    # ------------------------------------------------------------------------------------#
+    # Get, conditional GET: Success
+    # ------------------------------------------------------------------------------------#
+    def test_list_tasks_etag(self):
+        """Test conditional GET of tasks and people """
+        print('.............Parent:Test List Tasks ETag............')
+        headers = [('Authorization', f'Bearer {self.parent_user}')]
+        for path in ('/tasks', '/people'):
+            res = self.client().get(path, headers=headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(res.headers.get('ETag'))
+            self.assertTrue(res.headers.get('Last-Modified'))
+            self.assertEqual(res.headers['Cache-Control'], 'private, no-cache')
+            res = self.client().get(
+                    path, headers=headers + [('If-None-Match',
+                                              res.headers['ETag'])])
+            self.assertEqual(res.status_code, 304)
+
+        # Without the response cache a 304 reads table_versions only,
+        # never the listing
+        backend = response_cache.backend
+        use_backend(None)
+        try:
+            with mock.patch('app.get_tasks', wraps=get_tasks) as listing:
+                res = self.client().get('/tasks', headers=headers)
+                self.assertEqual(res.status_code, 200)
+                etag = res.headers['ETag']
+                last_modified = res.headers['Last-Modified']
+                res = self.client().get(
+                        '/tasks',
+                        headers=headers + [('If-None-Match', etag)])
+                self.assertEqual(res.status_code, 304)
+                self.assertEqual(res.headers['ETag'], etag)
+                res = self.client().get(
+                        '/tasks',
+                        headers=headers + [('If-Modified-Since',
+                                            last_modified)])
+                self.assertEqual(res.status_code, 304)
+                self.assertEqual(listing.call_count, 1)
+        finally:
+            use_backend(backend)
+
+        # A write bumps the task version: the old ETag no longer matches
+        task = {'description': 'I am task for etag'}
+        res = self.client().post(
+                '/tasks', json=task,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}'),
+                            ('Prefer', 'return=representation')
+                        ])
+        self.assertEqual(res.status_code, 201)
+        task_id = json.loads(res.data)['task']['id']
+        res = self.client().get(
+                '/tasks', headers=headers + [('If-None-Match', etag)])
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+        res = self.client().delete(
+                '/tasks/' + str(task_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
+    # ------------------------------------------------------------------------------------#
+    # Get streamed listing: Success
+    # ------------------------------------------------------------------------------------#
+    def test_list_stream(self):
+        """Test streamed listings match the regular ones """
+        print('.............Parent:Test List Stream............')
+        headers = [('Authorization', f'Bearer {self.parent_user}')]
+        task = {'description': 'I am task for stream'}
+        res = self.client().post(
+                '/tasks', json=task,
+                headers=headers + [('Prefer', 'return=representation')])
+        self.assertEqual(res.status_code, 201)
+        task_id = json.loads(res.data)['task']['id']
+
+        for path, key, total in (('/tasks', 'tasks', 'totalTasks'),
+                                 ('/people', 'people', 'totalPeople')):
+            res = self.client().get(path + '?stream=true', headers=headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(res.is_streamed)
+            self.assertTrue(res.headers.get('ETag'))
+            streamed = json.loads(res.data)
+            res = self.client().get(path, headers=headers)
+            listed = json.loads(res.data)
+            self.assertEqual(streamed['success'], True)
+            self.assertEqual(streamed[key], listed[key])
+            self.assertEqual(streamed[total], listed[total])
+            self.assertEqual(streamed[total], len(streamed[key]))
+            if key == 'tasks':
+                self.assertIn({'id': task_id,
+                               'description': task['description']},
+                              streamed['tasks'])
+
+        res = self.client().delete(
+                '/tasks/' + str(task_id) + '/delete',
+                headers=headers)
+        self.assertEqual(res.status_code, 200)
+
     # ------------------------------------------------------------------------------------#
     # Delete task Success
     # ------------------------------------------------------------------------------------#
@@ -160,6 +341,39 @@ class ChoremostaTestCase(unittest.TestCase):
         data = json.loads(res.data)
         self.assertEqual(data['success'], True)
 
+    # ------------------------------------------------------------------------------------#
+    # Add and delete task with Prefer: Success
+    # ------------------------------------------------------------------------------------#
+    def test_add_delete_task_prefer(self):
+        """Test Add and Delete Task with Prefer """
+        print('..............Parent:Test Add/Delete Task Prefer..........')
+        task = {'description': 'I am task for prefer'}
+        res = self.client().post(
+                '/tasks', json=task,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}'),
+                            ('Prefer', 'return=representation')
+                        ])
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.headers['Preference-Applied'],
+                         'return=representation')
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['task']['description'], task['description'])
+        task_id = data['task']['id']
+
+        res = self.client().delete(
+                '/tasks/' + str(task_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}'),
+                            ('Prefer', 'return=minimal')
+                        ])
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(res.headers['Preference-Applied'], 'return=minimal')
+        self.assertEqual(res.data, b'')
+
     # ------------------------------------------------------------------------------------#
     # Assign Tasks: Success
     # ------------------------------------------------------------------------------------#
@@ -239,6 +453,95 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         data = json.loads(res.data)
 
+    # ------------------------------------------------------------------------------------#
+    # Assign many tasks: Success
+    # ------------------------------------------------------------------------------------#
+    def test_assign_tasks_bulk(self):
+        """Test assign many tasks """
+        print('...............Parent:Test Assign Many Tasks.................')
+        res = self.client().post(
+                '/people', json=self.new_person_for_assign,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ], follow_redirects=True)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post(
+                '/people/find', json=self.new_person_for_assign)
+        person_id = json.loads(res.data).get('id', None)
+
+        res = self.client().post(
+                '/tasks', json=self.new_task_for_assign,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ], follow_redirects=True)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post(
+                '/tasks/find', json=self.new_task_for_assign)
+        task_id = json.loads(res.data).get('id', None)
+
+        date = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+        self.assignment = {
+            'personIds': [person_id],
+            'taskIds': [task_id, 0],
+            'startDate': date,
+            'dueBy': date,
+            'status': 'Pending'
+            }
+
+        res = self.client().post(
+                '/people/assign_tasks', json=self.assignment,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['assignments'][1]['result'], 'invalid')
+
+        # The same assignment again is a conflict
+        res = self.client().post(
+                '/people/assign_tasks', json=self.assignment,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        data = json.loads(res.data)
+        self.assertEqual(data['created'], 0)
+        self.assertEqual(data['assignments'][0]['result'], 'conflict')
+
+        # Booleans are not ids, as in /people/assign_task
+        res = self.client().post(
+                '/people/assign_tasks',
+                json=dict(self.assignment, taskIds=[True]),
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        data = json.loads(res.data)
+        self.assertEqual(data['created'], 0)
+        self.assertEqual(data['assignments'][0]['result'], 'invalid')
+
+        res = self.client().delete(
+                '/people/' + str(person_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().delete(
+                '/tasks/' + str(task_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
     # ------------------------------------------------------------------------------------#
     # Update task status: Success
     # ------------------------------------------------------------------------------------#
@@ -340,6 +643,165 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         data = json.loads(res.data)
 
+    # ------------------------------------------------------------------------------------#
+    # Assign and update task status with Prefer: Success
+    # ------------------------------------------------------------------------------------#
+    def test_update_task_status_prefer(self):
+        """Test Assign Task and Update Status with Prefer """
+        print('..............Parent:Test Update Status Prefer.............')
+        person = {'name': 'pr, ef', 'ssn': '24680'}
+        task = {'description': 'I am task for update with prefer'}
+        headers = [
+                    ('Content-Type', 'application/json'),
+                    ('Authorization', f'Bearer {self.parent_user}')
+                ]
+        representation = headers + [('Prefer', 'return=representation')]
+        minimal = headers + [('Prefer', 'return=minimal')]
+        res = self.client().post('/people', json=person,
+                                 headers=representation)
+        self.assertEqual(res.status_code, 201)
+        person_id = json.loads(res.data)['person']['id']
+        res = self.client().post('/tasks', json=task, headers=representation)
+        self.assertEqual(res.status_code, 201)
+        task_id = json.loads(res.data)['task']['id']
+
+        date = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+        assignment = {
+            'personId': person_id,
+            'taskId': task_id,
+            'startDate': date,
+            'dueBy': date,
+            'status': 'Pending'
+            }
+        res = self.client().post('/people/assign_task', json=assignment,
+                                 headers=representation)
+        self.assertEqual(res.status_code, 201)
+        data = json.loads(res.data)
+        self.assertEqual(data['personTask']['taskId'], task_id)
+        self.assertEqual(data['personTask']['status'], 'Pending')
+
+        update = {
+            'personId': person_id,
+            'taskId': task_id,
+            'startDate': date,
+            'status': 'Started'
+            }
+        res = self.client().patch('/people/update_task_status', json=update,
+                                  headers=minimal)
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(res.headers['Preference-Applied'], 'return=minimal')
+
+        update['status'] = 'Done'
+        res = self.client().patch('/people/update_task_status', json=update,
+                                  headers=representation)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Preference-Applied'],
+                         'return=representation')
+        data = json.loads(res.data)
+        self.assertEqual(data['personTask']['status'], 'Done')
+        # Each update bumps the row version of the user tasks ETag
+        with self.app.app_context():
+            version = db.session.query(PersonTask.version) \
+                .filter_by(personid=person_id, taskid=task_id).scalar()
+        self.assertEqual(version, 3)
+
+        res = self.client().delete('/people/' + str(person_id) + '/delete',
+                                   headers=representation)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['person']['id'], person_id)
+        res = self.client().delete('/tasks/' + str(task_id) + '/delete',
+                                   headers=minimal)
+        self.assertEqual(res.status_code, 204)
+
+    # ------------------------------------------------------------------------------------#
+    # Update many task statuses: Success
+    # ------------------------------------------------------------------------------------#
+    def test_update_task_statuses(self):
+        """Test update of many task statuses """
+        print('..............Parent:Test update of task statuses............')
+        res = self.client().post(
+                '/people', json=self.new_person_for_update,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ], follow_redirects=True)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post(
+                '/people/find', json=self.new_person_for_update)
+        person_id = json.loads(res.data).get('id', None)
+
+        res = self.client().post(
+                '/tasks', json=self.new_task_for_update,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ], follow_redirects=True)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post(
+                '/tasks/find', json=self.new_task_for_update)
+        task_id = json.loads(res.data).get('id', None)
+
+        date = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+        res = self.client().post(
+                '/people/assign_tasks',
+                json={'personIds': [person_id], 'taskIds': [task_id],
+                      'startDate': date, 'dueBy': date,
+                      'status': 'Pending'},
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
+        self.updates = {'updates': [
+            {'personId': person_id, 'taskId': task_id,
+             'startDate': date, 'status': 'Started'},
+            {'personId': person_id, 'taskId': 0,
+             'startDate': date, 'status': 'Started'},
+            {'personId': True, 'taskId': task_id,
+             'startDate': date, 'status': 'Started'}
+            ]}
+
+        res = self.client().patch(
+                '/people/update_task_statuses', json=self.updates,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.child_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual(data['updated'], 1)
+        self.assertEqual(data['updates'][0]['result'], 'updated')
+        self.assertEqual(data['updates'][1]['result'], 'not_found')
+        self.assertEqual(data['updates'][2]['result'], 'invalid')
+
+        # A body that is not an object
+        res = self.client().patch(
+                '/people/update_task_statuses', json=[1],
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.child_user}')
+                        ])
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().delete(
+                '/people/' + str(person_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().delete(
+                '/tasks/' + str(task_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
     # ------------------------------------------------------------------------------------#
     # Get list of all tasks for a user: Success
     #  ------------------------------------------------------------------------------------#
@@ -413,6 +875,39 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         data = json.loads(res.data)
         self.assertTrue(data['user_tasks'], True)
+        self.assertEqual(len(data['user_tasks']), 1)
+        self.assertEqual(data['user_tasks'][0]['taskId'], task_id)
+        self.assertEqual(data['user_tasks'][0]['description'],
+                         self.new_task_for_user_list['description'])
+
+        # Filters: the task is Pending and due in 10 days
+        in_5_days = (datetime.now() + timedelta(days=5)) \
+            .strftime("%Y-%m-%dT%H:%M:%S")
+        in_20_days = (datetime.now() + timedelta(days=20)) \
+            .strftime("%Y-%m-%dT%H:%M:%S")
+        for query, expected in (
+                ('status=Pending', 1),
+                ('status=Done', 0),
+                ('dueAfter=' + in_5_days, 1),
+                ('dueAfter=' + in_20_days, 0),
+                ('dueBefore=' + in_5_days, 0),
+                ('dueAfter=' + in_5_days + '&dueBefore=' + in_20_days, 1),
+                ('status=Done&dueBefore=' + in_20_days, 0)):
+            res = self.client().get(
+                    '/people/' + str(person_id) + '/tasks?' + query,
+                    headers=[
+                                ('Authorization', f'Bearer {self.parent_user}')
+                            ])
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.data)
+            self.assertEqual(len(data['user_tasks']), expected, query)
+
+        res = self.client().get(
+                '/people/' + str(person_id) + '/tasks?dueAfter=soon',
+                headers=[
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 400)
 
         res = self.client().delete(
                 '/people/' + str(person_id) + '/delete',
@@ -432,6 +927,185 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         data = json.loads(res.data)
 
+    # ------------------------------------------------------------------------------------#
+    # Get list of all tasks for a user, conditional GET: Success
+    # ------------------------------------------------------------------------------------#
+    def test_list_user_tasks_etag(self):
+        """Test conditional GET of tasks for user """
+        print('...............Parent:Test user tasks ETag................')
+        res = self.client().post(
+                '/people', json=self.new_person_for_user_list,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ], follow_redirects=True)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post(
+                '/people/find', json=self.new_person_for_user_list)
+        person_id = json.loads(res.data).get('id', None)
+
+        res = self.client().get(
+                '/people/' + str(person_id) + '/tasks',
+                headers=[
+                            ('Authorization', f'Bearer {self.child_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers.get('ETag')
+        self.assertTrue(etag)
+
+        res = self.client().get(
+                '/people/' + str(person_id) + '/tasks',
+                headers=[
+                            ('Authorization', f'Bearer {self.child_user}'),
+                            ('If-None-Match', etag)
+                        ])
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client().delete(
+                '/people/' + str(person_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
+    # ------------------------------------------------------------------------------------#
+    # Schema revision matches the newest migration
+    # ------------------------------------------------------------------------------------#
+    def test_schema_revision(self):
+        """Test SCHEMA_REVISION is the head of migrations """
+        print('..................Test Schema Revision......................')
+        from alembic.script import ScriptDirectory
+        migrations = os.path.join(os.path.dirname(__file__), 'migrations')
+        head = ScriptDirectory(migrations).get_current_head()
+        self.assertEqual(head, SCHEMA_REVISION)
+        with self.app.app_context():
+            self.assertTrue(check_schema(self.app))
+
+    # ------------------------------------------------------------------------------------#
+    # Connection pool metrics
+    # ------------------------------------------------------------------------------------#
+    def test_pool_metrics(self):
+        """Test connection pool metrics """
+        print('..................Test Pool Metrics.........................')
+        res = self.client().get(
+                '/tasks',
+                headers=[('Authorization', f'Bearer {self.parent_user}')])
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get(
+                '/metrics/pool',
+                headers=[('Authorization', f'Bearer {self.parent_user}')])
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['pool']['pool'])
+
+    # ------------------------------------------------------------------------------------#
+    # Metrics need a token, and METRICS_ENABLED
+    # ------------------------------------------------------------------------------------#
+    def test_metrics_auth(self):
+        """Test metrics endpoints are protected """
+        print('..................Test Metrics Auth.........................')
+        for path in ('/metrics/pool', '/metrics/cache'):
+            res = self.client().get(path)
+            self.assertEqual(res.status_code, 401)
+
+        app = create_app()
+        setup_db(app, self.database_path)
+        for path in ('/metrics/pool', '/metrics/cache'):
+            res = app.test_client().get(
+                    path,
+                    headers=[('Authorization', f'Bearer {self.parent_user}')])
+            self.assertEqual(res.status_code, 404)
+
+    # ------------------------------------------------------------------------------------#
+    # Disposing the engine (gunicorn fork hooks) keeps the pool settings
+    # ------------------------------------------------------------------------------------#
+    def test_dispose_engine(self):
+        """Test dispose_engine keeps pre-ping and the pool listeners """
+        print('..................Test Dispose Engine.......................')
+        with self.app.app_context():
+            pool = db.engine.pool
+            self.assertTrue(pool._pre_ping)
+            listeners = len(pool.dispatch.invalidate)
+            dispose_engine()
+            dispose_engine()
+            pool = db.engine.pool
+            self.assertTrue(pool._pre_ping)
+            self.assertEqual(len(pool.dispatch.invalidate), listeners)
+            res = self.client().get(
+                    '/tasks',
+                    headers=[('Authorization', f'Bearer {self.parent_user}')])
+            self.assertEqual(res.status_code, 200)
+
+    # ------------------------------------------------------------------------------------#
+    # Assign Tasks: malformed body
+    # ------------------------------------------------------------------------------------#
+    def test_assign_task_malformed(self):
+        """Test assign task rejects a malformed body """
+        print('.............Parent:Test Assign Task Malformed..............')
+        res = self.client().post(
+                '/people/assign_task',
+                json={'personId': 'one', 'taskId': 1,
+                      'startDate': 'not a date', 'status': 'Pending'},
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 400)
+        data = json.loads(res.data)
+        self.assertEqual(data['success'], False)
+
+    # ------------------------------------------------------------------------------------#
+    # Response cache: hit, then invalidated by a write
+    # ------------------------------------------------------------------------------------#
+    def test_response_cache(self):
+        """Test cached task listing is invalidated by a write """
+        print('..............Parent:Test Response Cache...................')
+        headers = [('Authorization', f'Bearer {self.parent_user}')]
+        res = self.client().get('/tasks', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        hits = json.loads(
+            self.client().get('/metrics/cache', headers=headers).data
+        )['responseCache']['hits']
+
+        res = self.client().get('/tasks', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get('/metrics/cache', headers=headers)
+        data = json.loads(res.data)
+        self.assertEqual(data['responseCache']['hits'], hits + 1)
+
+        task = {'description': 'I am task for response cache'}
+        res = self.client().post(
+                '/tasks', json=task,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ], follow_redirects=True)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/tasks', headers=headers)
+        data = json.loads(res.data)
+        self.assertIn(task['description'],
+                      [t['description'] for t in data['tasks']])
+
+        # A delete committed by another worker (no commit hook runs
+        # in this one) is seen through table_versions. Also the cleanup.
+        res = self.client().post('/tasks/find', json=task)
+        task_id = json.loads(res.data).get('id', None)
+        with self.app.app_context():
+            db.engine.execute(Task.__table__.delete()
+                              .where(Task.id == task_id))
+            db.engine.execute(TableVersion.__table__.update()
+                              .where(TableVersion.name == 'task')
+                              .values(version=TableVersion.version + 1))
+        res = self.client().get('/tasks', headers=headers)
+        data = json.loads(res.data)
+        self.assertNotIn(task['description'],
+                         [t['description'] for t in data['tasks']])
+
     # #************************************************************************************#
     # # People:Parent
     # #************************************************************************************#
@@ -451,6 +1125,80 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+        # Cleanup: uq_person would reject the same person on the next run
+        res = self.client().post('/people/find', json=self.new_person)
+        person_id = json.loads(res.data).get('id', None)
+        res = self.client().delete(
+                '/people/' + str(person_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+        self.assertEqual(res.status_code, 200)
+
+    # ------------------------------------------------------------------------------------#
+    # Import: Success
+    # ------------------------------------------------------------------------------------#
+    def test_import_people(self):
+        """Test Import People """
+        print('..................Parent:Test Import People..............')
+        body = 'name,ssn\n"imp, 1",1111\n"imp, 2",2222\n"imp, 3",\n'
+        # COPY on PostgreSQL, then the INSERT fallback with one row
+        # per INSERT, so every chunk of the batch has to be written
+        for copy in (supports_copy, lambda: False):
+            with mock.patch('lib.supports_copy', copy), \
+                    mock.patch('lib.INSERT_CHUNK_SIZE', 1):
+                res = self.client().post(
+                        '/people/import', data=body,
+                        headers=[
+                            ('Content-Type', 'text/csv'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['success'], True)
+            self.assertEqual(data['inserted'], 2)
+            self.assertEqual(data['rejected'], 1)
+
+            # Cleanup
+            for person in [{'name': 'imp, 1', 'ssn': '1111'},
+                           {'name': 'imp, 2', 'ssn': '2222'}]:
+                res = self.client().post('/people/find', json=person)
+                person_id = json.loads(res.data).get('id', None)
+                res = self.client().delete(
+                        '/people/' + str(person_id) + '/delete',
+                        headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}')
+                        ])
+                self.assertEqual(res.status_code, 200)
+
+    # ------------------------------------------------------------------------------------#
+    # Import: malformed uploads
+    # ------------------------------------------------------------------------------------#
+    def test_import_people_malformed(self):
+        """Test Import People rejects malformed rows and bodies """
+        print('..............Parent:Test Import People Malformed........')
+        headers = [
+                    ('Content-Type', 'text/csv'),
+                    ('Authorization', f'Bearer {self.parent_user}')
+                ]
+        res = self.client().post('/people/import',
+                                 data=b'name,ssn\n\xff\xfe,1\n',
+                                 headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+        # A NUL byte and a field over csv.field_size_limit()
+        body = ('name,ssn\n"imp\x00, 4",4444\n"' + 'x' * 200000 +
+                '",5555\n')
+        res = self.client().post('/people/import', data=body,
+                                 headers=headers)
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual(data['inserted'], 0)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual(data['rejectedLines'], [2, 3])
+
     # ------------------------------------------------------------------------------------#
     # Get: Success
     # ------------------------------------------------------------------------------------#
@@ -501,6 +1249,41 @@ class ChoremostaTestCase(unittest.TestCase):
         data = json.loads(res.data)
         self.assertEqual(data['success'], True)
 
+    # ------------------------------------------------------------------------------------#
+    # Add and delete person with Prefer: Success
+    # ------------------------------------------------------------------------------------#
+    def test_add_delete_person_prefer(self):
+        """Test Add and Delete Person with Prefer """
+        print('.............Parent:Test Add/Delete Person Prefer..........')
+        person = {'name': 'pre, fer', 'ssn': '13579'}
+        res = self.client().post(
+                '/people', json=person,
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}'),
+                            ('Prefer', 'return=minimal')
+                        ])
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(res.headers['Preference-Applied'], 'return=minimal')
+        self.assertEqual(res.data, b'')
+
+        res = self.client().post('/people/find', json=person)
+        person_id = json.loads(res.data).get('id', None)
+
+        res = self.client().delete(
+                '/people/' + str(person_id) + '/delete',
+                headers=[
+                            ('Content-Type', 'application/json'),
+                            ('Authorization', f'Bearer {self.parent_user}'),
+                            ('Prefer', 'return=representation')
+                        ])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Preference-Applied'],
+                         'return=representation')
+        data = json.loads(res.data)
+        self.assertEqual(data['person'],
+                         {'id': person_id, 'name': person['name']})
+
     # ************************************************************************************#
     # Tasks:Child
     # ************************************************************************************#
@@ -929,6 +1712,298 @@ class ChoremostaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
 
 
+# ************************************************************************************#
+# Auth caches. No database needed.
+# ************************************************************************************#
+def fake_jwks(*kids):
+    return {'keys': [{'kty': 'RSA', 'kid': kid, 'use': 'sig',
+                      'n': 'n-' + kid, 'e': 'AQAB'} for kid in kids]}
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """JWKSCache against a fake fetch"""
+
+    def setUp(self):
+        self.jwks = fake_jwks('k1')
+        self.fetches = 0
+        self.delay = 0
+        self.failing = False
+
+    def fetch(self):
+        self.fetches += 1
+        time.sleep(self.delay)
+        if self.failing:
+            raise OSError('jwks.json unreachable')
+        return self.jwks
+
+    # ------------------------------------------------------------------------------------#
+    # Concurrent misses share one fetch
+    # ------------------------------------------------------------------------------------#
+    def test_single_flight(self):
+        """Test 20 concurrent misses fetch the keys once """
+        print('..................Test JWKS Single Flight..................')
+        cache = JWKSCache(self.fetch)
+        self.delay = 0.1
+        start = threading.Barrier(20)
+        keys = []
+
+        def get_key():
+            start.wait()
+            keys.append(cache.get_key('k1'))
+        threads = [threading.Thread(target=get_key) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(len(keys), 20)
+        self.assertTrue(all(key['kid'] == 'k1' for key in keys))
+
+    # ------------------------------------------------------------------------------------#
+    # A failed refresh keeps the keys already held
+    # ------------------------------------------------------------------------------------#
+    def test_failed_refresh_keeps_keys(self):
+        """Test keys are served after a failed refresh """
+        print('..................Test JWKS Failed Refresh.................')
+        cache = JWKSCache(self.fetch, ttl=0, min_refresh_interval=0)
+        key = cache.get_key('k1')
+        self.assertIsNotNone(key)
+        self.failing = True
+
+        # Unknown kid: the synchronous refresh fails
+        self.assertIsNone(cache.get_key('k2'))
+        self.assertEqual(self.fetches, 2)
+        # Stale key: served at once, the background refresh fails
+        self.assertEqual(cache.get_key('k1'), key)
+        with cache.lock:
+            # Held by the background refresh until it is done
+            pass
+        self.assertEqual(self.fetches, 3)
+        self.assertEqual(cache.keys, {'k1': key})
+
+    # ------------------------------------------------------------------------------------#
+    # Unknown kids refetch at most once per min_refresh_interval
+    # ------------------------------------------------------------------------------------#
+    def test_refresh_throttle(self):
+        """Test min_refresh_interval throttles unknown kid refreshes """
+        print('..................Test JWKS Refresh Throttle...............')
+        cache = JWKSCache(self.fetch, min_refresh_interval=30)
+        self.assertIsNotNone(cache.get_key('k1'))
+        for _ in range(5):
+            self.assertIsNone(cache.get_key('unknown'))
+        self.assertEqual(self.fetches, 1)
+
+        # Once the interval has passed a new kid is picked up
+        self.jwks = fake_jwks('k1', 'k2')
+        cache.last_attempt -= 30
+        self.assertIsNotNone(cache.get_key('k2'))
+        self.assertEqual(self.fetches, 2)
+
+
+class LocalKeysTestCase(unittest.TestCase):
+    """Base of the test cases verifying tokens signed by local keys"""
+    private_pem = None
+    jwks = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = auth.auth.ISSUER
+        cls.fetch = jwks_cache.fetch
+        # one key pair per test run: generating it takes a while
+        if LocalKeysTestCase.jwks is None:
+            LocalKeysTestCase.private_pem, LocalKeysTestCase.jwks = \
+                generate_key_pair()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Back to the keys the other test cases verify against
+        auth.auth.ISSUER = cls.issuer
+        jwks_cache.fetch = cls.fetch
+        jwks_cache.clear()
+        token_cache.clear()
+
+    def setUp(self):
+        # Also empties both caches
+        use_local_keys(self.jwks)
+
+
+class TokenCacheTestCase(LocalKeysTestCase):
+    """TokenCache, with tokens signed by throwaway local keys"""
+
+    # ------------------------------------------------------------------------------------#
+    # Entries expire at the token's exp
+    # ------------------------------------------------------------------------------------#
+    def test_expiry(self):
+        """Test cached tokens expire at exp """
+        print('..................Test Token Cache Expiry..................')
+        cache = TokenCache()
+        principal = Principal({'sub': 'valid', 'exp': time.time() + 60})
+        cache.put('valid', principal, 'k1')
+        self.assertIs(cache.get('valid'), principal)
+
+        cache.put('expired', Principal({'sub': 'expired',
+                                        'exp': time.time()}), 'k1')
+        self.assertIsNone(cache.get('expired'))
+        self.assertEqual(cache.stats()['size'], 1)
+
+        # Without exp a token is never cached
+        cache.put('no exp', Principal({'sub': 'no exp'}), 'k1')
+        self.assertIsNone(cache.get('no exp'))
+
+    # ------------------------------------------------------------------------------------#
+    # Least recently used entries are evicted at maxsize
+    # ------------------------------------------------------------------------------------#
+    def test_lru_eviction(self):
+        """Test the least recently used token is evicted at maxsize """
+        print('..................Test Token Cache LRU.....................')
+        cache = TokenCache(maxsize=2)
+        exp = time.time() + 60
+        for token in ('a', 'b'):
+            cache.put(token, Principal({'sub': token, 'exp': exp}), 'k1')
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', Principal({'sub': 'c', 'exp': exp}), 'k1')
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    # ------------------------------------------------------------------------------------#
+    # Hit and miss counters
+    # ------------------------------------------------------------------------------------#
+    def test_counters(self):
+        """Test token cache hit and miss counters """
+        print('..................Test Token Cache Counters................')
+        token = mint_token(self.private_pem, 'child')
+        before = token_cache.stats()
+        principal = get_principal(token)
+        self.assertIs(get_principal(token), principal)
+        self.assertIs(get_principal(token), principal)
+        stats = token_cache.stats()
+        self.assertEqual(stats['misses'], before['misses'] + 1)
+        self.assertEqual(stats['hits'], before['hits'] + 2)
+        self.assertEqual(stats['size'], 1)
+
+    # ------------------------------------------------------------------------------------#
+    # Key rotation evicts the tokens signed with the retired key
+    # ------------------------------------------------------------------------------------#
+    def test_key_rotation(self):
+        """Test tokens of a retired signing key are evicted """
+        print('..................Test Token Cache Key Rotation............')
+        token = mint_token(self.private_pem, 'parent')
+        get_principal(token)
+        self.assertIsNotNone(token_cache.get(token))
+
+        rotated_pem, rotated_jwks = generate_key_pair(kid='rotated',
+                                                      bits=1024)
+        jwks_cache.fetch = lambda: rotated_jwks
+        jwks_cache.last_attempt -= jwks_cache.min_refresh_interval
+        # The new kid is unknown: the key set is refreshed and the
+        # old kid is no longer published
+        get_principal(mint_token(rotated_pem, 'parent', kid='rotated'))
+        self.assertIsNone(token_cache.get(token))
+        with self.assertRaises(AuthError):
+            get_principal(token)
+
+
+class PermissionsTestCase(LocalKeysTestCase):
+    """check_permissions and requires_auth"""
+
+    def principal(self, *permissions):
+        return Principal({'sub': 'tester', 'permissions': permissions})
+
+    def assertDenied(self, status_code, *args, **kwargs):
+        with self.assertRaises(AuthError) as denied:
+            check_permissions(*args, **kwargs)
+        self.assertEqual(denied.exception.status_code, status_code)
+
+    # ------------------------------------------------------------------------------------#
+    # All-of and any-of permission checks
+    # ------------------------------------------------------------------------------------#
+    def test_check_permissions(self):
+        """Test all-of, any-of and empty permission checks """
+        print('..................Test Check Permissions..................')
+        principal = self.principal('add_task', 'list_all_tasks')
+        self.assertTrue(check_permissions('add_task', principal))
+        self.assertTrue(check_permissions(('add_task', 'list_all_tasks'),
+                                          principal))
+        self.assertDenied(401, ('add_task', 'delete_task'), principal)
+
+        self.assertTrue(check_permissions(('add_task', 'delete_task'),
+                                          principal, 'any'))
+        self.assertDenied(401, ('add_person', 'delete_task'), principal,
+                          'any')
+
+        # No permission required: any token with a permissions claim
+        self.assertTrue(check_permissions((), self.principal()))
+        self.assertTrue(check_permissions((), self.principal(), 'any'))
+        self.assertDenied(400, (), Principal({'sub': 'tester'}))
+
+        # A raw payload is accepted too
+        self.assertTrue(check_permissions(
+            'add_task', {'permissions': ['add_task']}))
+
+    # ------------------------------------------------------------------------------------#
+    # requires_auth: match, no permissions and current_user
+    # ------------------------------------------------------------------------------------#
+    def test_requires_auth(self):
+        """Test requires_auth match modes and current_user """
+        print('..................Test Requires Auth........................')
+        app = Flask(__name__)
+
+        def view(payload):
+            return payload['sub'], _request_ctx_stack.top.current_user
+
+        all_of = requires_auth('add_task', 'list_user_tasks')(view)
+        any_of = requires_auth('add_task', 'list_user_tasks',
+                               match='any')(view)
+        any_token = requires_auth()(view)
+        child = mint_token(self.private_pem, 'child')
+        nobody = mint_token(self.private_pem, permissions=[],
+                            subject='local|nobody')
+
+        with app.test_request_context(
+                headers={'Authorization': f'Bearer {child}'}):
+            subject, current_user = any_of()
+            self.assertEqual(subject, 'local|child')
+            self.assertIsInstance(current_user, Principal)
+            self.assertEqual(current_user.subject, 'local|child')
+            self.assertIn('list_user_tasks', current_user.permissions)
+            with self.assertRaises(AuthError) as denied:
+                all_of()
+            self.assertEqual(denied.exception.status_code, 401)
+
+        with app.test_request_context(
+                headers={'Authorization': f'Bearer {nobody}'}):
+            subject, current_user = any_token()
+            self.assertEqual(current_user.permissions, frozenset())
+            with self.assertRaises(AuthError):
+                any_of()
+
+        with self.assertRaises(ValueError):
+            requires_auth('add_task', match='some')
+
+
+class SerializationTestCase(unittest.TestCase):
+    """JSON providers against flask.jsonify"""
+
+    # ------------------------------------------------------------------------------------#
+    # The stdlib provider writes what flask.jsonify writes
+    # ------------------------------------------------------------------------------------#
+    def test_stdlib_matches_flask(self):
+        """Test stdlib provider output matches flask.jsonify """
+        print('..................Test Stdlib JSON Provider.................')
+        app = Flask(__name__)
+        data = {'tasks': [{'id': 1, 'description': 'd\u00e9'}],
+                'dueBy': datetime(2020, 10, 25), 'user': None}
+        with mock.patch('serialization.provider',
+                        serialization.StdlibProvider('http')):
+            for pretty in (False, True):
+                app.config['JSONIFY_PRETTYPRINT_REGULAR'] = pretty
+                with app.app_context():
+                    self.assertEqual(jsonify(data).get_data(),
+                                     flask_jsonify(data).get_data())
+
+
 #
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+from app import create_app
+
+'''
+WSGI entry point: gunicorn wsgi:app
+'''
+
+app = create_app()